@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from synthetic_repositories import SyntheticRepository
+
+
+class AzureDevopsStandIn(object):
+    def __init__(self, repositories: List[SyntheticRepository], host="127.0.0.1", port=0, page_size=100, throttle_rate=0.0, seed=0):
+        self.repositories = repositories
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _create_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def should_throttle(self):
+        with self._lock:
+            return self._random.random() < self.throttle_rate
+
+    def get_projects(self, organization):
+        return sorted(set(r.project for r in self.repositories if r.organization == organization))
+
+    def get_repositories(self, organization, project=None):
+        return [r for r in self.repositories if r.organization == organization and (project is None or r.project == project)]
+
+    def get_repository(self, organization, repository_id):
+        for repository in self.get_repositories(organization):
+            if repository_id in (repository.id, repository.name):
+                return repository
+        return None
+
+
+def _create_handler(stand_in: AzureDevopsStandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            parts = [unquote(p) for p in url.path.strip("/").split("/")]
+            query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+            if stand_in.should_throttle():
+                stand_in.count("throttled")
+                if self.command == "POST":
+                    self._read_body()
+                return self._send_json(429, {"message": "Request was blocked due to exceeding usage of resource."},
+                                       {"Retry-After": "1", "X-RateLimit-Resource": "ATCPU", "X-RateLimit-Delay": "1",
+                                        "X-RateLimit-Limit": "200", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 1)})
+
+            if "_git" in parts:
+                index = parts.index("_git")
+                return self._git(parts[0], parts[index - 1], parts[index + 1], "/".join(parts[index + 2:]), url.query)
+            if len(parts) == 3 and parts[1:] == ["_apis", "projects"]:
+                return self._projects(parts[0], query)
+            if len(parts) == 5 and parts[1:4] == ["_apis", "git", "repositories"]:
+                return self._repository(parts[0], None, parts[4])
+            if len(parts) == 5 and parts[2:] == ["_apis", "git", "repositories"]:
+                return self._repositories(parts[0], parts[1])
+            if len(parts) == 6 and parts[2:5] == ["_apis", "git", "repositories"]:
+                return self._repository(parts[0], parts[1], parts[5])
+            if len(parts) == 7 and parts[2:5] == ["_apis", "git", "repositories"] and parts[6] == "pushes":
+                return self._pushes(parts[0], parts[5])
+            if len(parts) == 6 and parts[1:4] == ["_apis", "git", "repositories"] and parts[5] == "refs":
+                return self._refs(parts[0], parts[4])
+            self._send_json(404, {"message": f"Unknown endpoint {url.path}"})
+
+        def _projects(self, organization, query):
+            stand_in.count("projects")
+            projects = stand_in.get_projects(organization)
+            start = int(query.get("continuationToken", 0))
+            top = int(query.get("$top", stand_in.page_size))
+            headers = {}
+            if start + top < len(projects):
+                headers["x-ms-continuationtoken"] = str(start + top)
+            self._send_listing({"value": [{"name": p} for p in projects[start:start + top]]}, headers)
+
+        def _repositories(self, organization, project):
+            stand_in.count("repositories")
+            if project not in stand_in.get_projects(organization):
+                return self._send_json(404, {"message": "Project not found."})
+            self._send_listing({"value": [self._repository_json(r) for r in stand_in.get_repositories(organization, project)]})
+
+        def _repository(self, organization, project, repository_id):
+            stand_in.count("repository")
+            repository = next((r for r in stand_in.get_repositories(organization, project) if repository_id in (r.id, r.name)), None)
+            if repository is None:
+                return self._send_json(404, {"message": "Repository not found."})
+            self._send_json(200, self._repository_json(repository))
+
+        def _repository_json(self, repository: SyntheticRepository):
+            return {"id": repository.id, "name": repository.name, "project": {"name": repository.project},
+                    "remoteUrl": f"{stand_in.url}/{repository.organization}/{repository.project}/_git/{repository.name}"}
+
+        def _pushes(self, organization, repository_id):
+            stand_in.count("pushes")
+            repository = stand_in.get_repository(organization, repository_id)
+            if repository is None:
+                return self._send_json(404, {"message": "Repository not found."})
+
+            output = _run_git(repository, "for-each-ref", "--sort=-committerdate", "--count=1", "--format=%(committerdate:unix)")
+            date = datetime.fromtimestamp(int(output.strip() or 0), timezone.utc)
+            self._send_json(200, {"value": [{"date": date.isoformat()}]})
+
+        def _refs(self, organization, repository_id):
+            stand_in.count("refs")
+            repository = stand_in.get_repository(organization, repository_id)
+            if repository is None:
+                return self._send_json(404, {"message": "Repository not found."})
+
+            output = _run_git(repository, "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads")
+            refs = [line.split(" ", 1) for line in output.split("\n") if line]
+            self._send_json(200, {"value": [{"name": name, "objectId": sha} for sha, name in refs]})
+
+        def _git(self, organization, project, name, path_info, query):
+            stand_in.count("git")
+            repository = next((r for r in stand_in.get_repositories(organization, project) if r.name == name), None)
+            if repository is None:
+                return self._send_json(404, {"message": "Repository not found."})
+
+            env = dict(os.environ,
+                       GIT_PROJECT_ROOT=str(repository.path),
+                       GIT_HTTP_EXPORT_ALL="1",
+                       PATH_INFO="/" + path_info,
+                       QUERY_STRING=query,
+                       REQUEST_METHOD=self.command,
+                       CONTENT_TYPE=self.headers.get("Content-Type", ""),
+                       HTTP_CONTENT_ENCODING=self.headers.get("Content-Encoding", ""),
+                       GIT_PROTOCOL=self.headers.get("Git-Protocol", ""),
+                       REMOTE_USER="benchmark",
+                       REMOTE_ADDR=self.client_address[0])
+
+            output = subprocess.run(["git", "http-backend"], input=self._read_body(), env=env, stdout=subprocess.PIPE, check=True).stdout
+            header, _, body = output.partition(b"\r\n\r\n")
+
+            status = 200
+            headers = {}
+            for line in header.decode("latin-1").split("\r\n"):
+                key, _, value = line.partition(":")
+                if key.lower() == "status":
+                    status = int(value.strip().split(" ")[0])
+                elif key:
+                    headers[key] = value.strip()
+            self._send(status, body, headers)
+
+        def _read_body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                body = bytearray()
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return bytes(body)
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _send_listing(self, value, headers=None):
+            body = json.dumps(value).encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                stand_in.count("not_modified")
+                return self._send(304, b"", dict(headers or {}, ETag=etag))
+            self._send(200, body, dict(headers or {}, **{"Content-Type": "application/json", "ETag": etag}))
+
+        def _send_json(self, status, value, headers=None):
+            self._send(status, json.dumps(value).encode(), dict(headers or {}, **{"Content-Type": "application/json"}))
+
+        def _send(self, status, body: bytes, headers: Dict[str, str]):
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def _run_git(repository: SyntheticRepository, *args) -> str:
+    return subprocess.run(["git", *args], cwd=str(repository.path), stdout=subprocess.PIPE, text=True, check=True).stdout
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import json
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from synthetic_repositories import SyntheticRepository
+
+EMPTY_OBJECT_ID = "0" * 40
+
+
+class PushEventStandIn(object):
+    def __init__(self, receiver_url, username="", password=""):
+        self.receiver_url = receiver_url
+        self._authorization = "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode() if password else None
+        self.responses: Dict[int, int] = {}
+
+    def post(self, event: Dict) -> int:
+        request = Request(self.receiver_url, data=json.dumps(event).encode(), method="POST", headers={"Content-Type": "application/json"})
+        if self._authorization:
+            request.add_header("Authorization", self._authorization)
+
+        try:
+            with urlopen(request) as response:
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        self.responses[status] = self.responses.get(status, 0) + 1
+        return status
+
+    def replay(self, events: Iterable[Dict]):
+        for event in events:
+            self.post(event)
+
+    def push(self, repository: SyntheticRepository, base_url, previous_refs: Dict[str, str]) -> Dict[str, str]:
+        refs = get_refs(repository)
+        ref_updates = dict((name, (previous_refs.get(name, EMPTY_OBJECT_ID), sha)) for name, sha in refs.items() if previous_refs.get(name) != sha)
+        ref_updates.update((name, (sha, EMPTY_OBJECT_ID)) for name, sha in previous_refs.items() if name not in refs)
+        if ref_updates:
+            self.post(create_push_event(repository, base_url, ref_updates))
+        return refs
+
+
+def get_refs(repository: SyntheticRepository) -> Dict[str, str]:
+    output = subprocess.run(["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads"], cwd=str(repository.path),
+                            stdout=subprocess.PIPE, text=True, check=True).stdout
+    refs = [line.split(" ", 1) for line in output.split("\n") if line]
+    return dict((name, sha) for sha, name in refs)
+
+
+def create_push_event(repository: SyntheticRepository, base_url, ref_updates: Dict[str, tuple], date: Optional[datetime] = None) -> Dict:
+    date = (date or datetime.now(timezone.utc)).isoformat()
+    project_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{repository.organization}/{repository.project}"))
+    return {
+        "id": str(uuid.uuid4()),
+        "eventType": "git.push",
+        "publisherId": "tfs",
+        "resource": {
+            "refUpdates": [{"name": name, "oldObjectId": old, "newObjectId": new} for name, (old, new) in ref_updates.items()],
+            "repository": {
+                "id": repository.id,
+                "name": repository.name,
+                "url": f"{base_url}/{repository.organization}/{project_id}/_apis/git/repositories/{repository.id}",
+                "project": {"id": project_id, "name": repository.project},
+                "remoteUrl": f"{base_url}/{repository.organization}/{repository.project}/_git/{repository.name}",
+            },
+            "pushId": 1,
+            "date": date,
+        },
+        "resourceContainers": {"account": {"baseUrl": f"{base_url}/{repository.organization}/"}},
+        "createdDate": date,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Posts recorded Azure DevOps git.push service hook payloads to a receiver.")
+    parser.add_argument("receiver_url", help="URL of the receiver, e.g. http://127.0.0.1:8080/.")
+    parser.add_argument("events_file", help="File with one recorded service hook payload per line.")
+    parser.add_argument("--username", default="", help="Basic authentication user name configured on the service hook.")
+    parser.add_argument("--password", default="", help="Basic authentication password configured on the service hook.")
+    args = parser.parse_args()
+
+    stand_in = PushEventStandIn(args.receiver_url, args.username, args.password)
+    with open(args.events_file, "r") as f:
+        stand_in.replay(json.loads(line) for line in f if line.strip())
+    json.dump(stand_in.responses, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import azure_devops_gitleaks_monitor  # noqa: E402,F401 Adds the package directory to the path.
+import main  # noqa: E402
+from azure_devops_stand_in import AzureDevopsStandIn  # noqa: E402
+from model import Configuration  # noqa: E402
+from run_metrics import metrics  # noqa: E402
+from scanner import Scanner  # noqa: E402
+from synthetic_repositories import SyntheticRepositoryGenerator  # noqa: E402
+
+ORGANIZATION = "benchmark"
+
+
+def run(label, configuration, args, stand_in: AzureDevopsStandIn, repositories, output_file):
+    metrics.reset()
+    stand_in.requests.clear()
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        main.execute(configuration, False, str(output_file), False, args.workers)
+    elapsed = time.perf_counter() - started
+
+    with open(output_file, "r") as f:
+        findings = max(0, sum(1 for _ in f) - 1)
+
+    return {
+        "run": label,
+        "repositories": len(repositories),
+        "elapsed": round(elapsed, 3),
+        "repositories_per_hour": round(len(repositories) / elapsed * 3600, 1) if elapsed else None,
+        "findings": findings,
+        "requests": dict(stand_in.requests),
+        "phases": summarize_phases(metrics.to_dict()),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_children_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of azure-devops-gitleaks-monitor.")
+    parser.add_argument("--workdir", action="store", dest="workdir", default=None, help="Directory where repositories and caches are created. Defaults to a temporary directory.")
+    parser.add_argument("--projects", action="store", type=int, default=10, help="Number of projects. Defaults to 10.")
+    parser.add_argument("--repos", action="store", type=int, default=10, help="Number of repositories per project. Defaults to 10.")
+    parser.add_argument("--commits", action="store", type=int, default=50, help="Number of commits on the main branch of each repository. Defaults to 50.")
+    parser.add_argument("--branches", action="store", type=int, default=3, help="Number of branches per repository. Defaults to 3.")
+    parser.add_argument("--branch-commits", action="store", type=int, default=5, dest="branch_commits", help="Number of commits on each additional branch. Defaults to 5.")
+    parser.add_argument("--blob-size", action="store", type=int, default=2048, dest="blob_size", help="Size in bytes of each committed file. Defaults to 2048.")
+    parser.add_argument("--secrets", action="store", type=int, default=2, help="Number of commits with a planted secret per repository. Defaults to 2.")
+    parser.add_argument("--changed", action="store", type=float, default=0.1, help="Fraction of repositories receiving new commits before the incremental run. Defaults to 0.1.")
+    parser.add_argument("--workers", "-w", action="store", type=int, default=1, help="Number of repositories scanned in parallel. Defaults to 1.")
+    parser.add_argument("--engine", action="store", choices=("gitleaks", "native"), default=Scanner.engine, help="Engine detecting the secrets. Defaults to gitleaks.")
+    parser.add_argument("--throttle-rate", action="store", type=float, default=0.0, dest="throttle_rate", help="Fraction of the requests throttled by the stand-in with a 429 and a Retry-After of 1 second. Defaults to 0.")
+    parser.add_argument("--seed", action="store", type=int, default=0, help="Random seed. Defaults to 0.")
+    parser.add_argument("--report", action="store", dest="report_file", default=None, help="File where the JSON report will be saved.")
+    parser.add_argument("-v", action="store_true", dest="verbose", default=False, help="Increases output verbosity.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    Scanner.engine = args.engine
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="gitleaks-monitor-benchmark-"))
+    generator = SyntheticRepositoryGenerator(workdir / "remote", args.commits, args.branches, args.branch_commits,
+                                             blob_size=args.blob_size, secrets=args.secrets, seed=args.seed)
+
+    started = time.perf_counter()
+    repositories = generator.generate_organization(ORGANIZATION, args.projects, args.repos)
+    print(f"Generated {len(repositories)} repositories in {time.perf_counter() - started:.1f}s under {workdir}.", file=sys.stderr)
+
+    results = []
+    with AzureDevopsStandIn(repositories, throttle_rate=args.throttle_rate, seed=args.seed) as stand_in:
+        configuration = Configuration({"organizations": {ORGANIZATION: {"url": stand_in.url, "username": "benchmark", "password": "benchmark"}}})
+
+        with main.open_cache(workdir / "cache"):
+            results.append(run("initial", configuration, args, stand_in, repositories, workdir / "initial.csv"))
+            results.append(run("unchanged", configuration, args, stand_in, repositories, workdir / "unchanged.csv"))
+
+            for repository in repositories[:int(len(repositories) * args.changed)]:
+                generator.add_commits(repository, 3)
+            results.append(run("incremental", configuration, args, stand_in, repositories, workdir / "incremental.csv"))
+
+    report = {"parameters": vars(args), "planted_secrets": sum(r.planted_secrets for r in repositories), "runs": results}
+    output = json.dumps(report, indent=1)
+    if args.report_file:
+        Path(args.report_file).write_text(output)
+    print(output)
+
+
+def summarize_phases(report):
+    per_repository = {}
+    for repository in report["repositories"].values():
+        for phase, duration in repository.get("phases", {}).items():
+            per_repository.setdefault(phase, []).append(duration)
+
+    summary = {}
+    for phase, totals in report["phases"].items():
+        summary[phase] = {"count": totals["count"], "total": round(totals["seconds"], 3), "max": round(totals["max"], 3)}
+        values = per_repository.get(phase)
+        if values:
+            summary[phase]["p50"] = round(statistics.median(values), 3)
+            summary[phase]["p95"] = round(_percentile(values, 0.95), 3)
+    return summary
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile * (len(ordered) - 1))))]
+
+
+if __name__ == "__main__":
+    main_benchmark()
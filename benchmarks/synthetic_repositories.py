@@ -0,0 +1,103 @@
+import random
+import string
+import subprocess
+import uuid
+from pathlib import Path
+from typing import List
+
+words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima",
+         "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform", "victor", "whiskey"]
+
+
+class SyntheticRepository(object):
+    def __init__(self, organization, project, name, path: Path):
+        self.organization = organization
+        self.project = project
+        self.name = name
+        self.path = path
+        self.id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{organization}/{project}/{name}"))
+        self.planted_secrets = 0
+
+
+class SyntheticRepositoryGenerator(object):
+    def __init__(self, root: Path, commits=50, branches=3, branch_commits=5, files=20, blob_size=2048, secrets=2, seed=0):
+        self.root = root
+        self.commits = commits
+        self.branches = branches
+        self.branch_commits = branch_commits
+        self.files = files
+        self.blob_size = blob_size
+        self.secrets = secrets
+        self._random = random.Random(seed)
+        self._timestamp = 1600000000
+
+    def generate_organization(self, organization, projects, repositories_per_project) -> List[SyntheticRepository]:
+        repositories = []
+        for p in range(projects):
+            for r in range(repositories_per_project):
+                repository = SyntheticRepository(organization, f"project-{p}", f"repository-{r}",
+                                                 self.root / organization / f"project-{p}" / f"repository-{r}.git")
+                self.generate(repository)
+                repositories.append(repository)
+        return repositories
+
+    def generate(self, repository: SyntheticRepository):
+        repository.path.mkdir(parents=True, exist_ok=True)
+        subprocess.run(["git", "init", "--quiet", "--bare", str(repository.path)], check=True)
+
+        total_commits = self.commits + max(0, self.branches - 1) * self.branch_commits
+        secret_commits = set(self._random.sample(range(total_commits), min(self.secrets, total_commits)))
+        repository.planted_secrets = len(secret_commits)
+
+        stream = bytearray()
+        mark = 0
+        for i in range(self.commits):
+            mark += 1
+            stream += self._commit("refs/heads/main", mark, mark - 1 if i > 0 else None, i in secret_commits)
+
+        main_marks = list(range(1, mark + 1))
+        for b in range(1, self.branches):
+            parent = self._random.choice(main_marks)
+            for i in range(self.branch_commits):
+                mark += 1
+                index = self.commits + (b - 1) * self.branch_commits + i
+                stream += self._commit(f"refs/heads/feature-{b}", mark, parent if i == 0 else mark - 1, index in secret_commits)
+
+        subprocess.run(["git", "fast-import", "--quiet"], cwd=str(repository.path), input=bytes(stream), check=True)
+
+    def add_commits(self, repository: SyntheticRepository, commits, branch="main"):
+        tip = subprocess.run(["git", "rev-parse", f"refs/heads/{branch}"], cwd=str(repository.path),
+                             stdout=subprocess.PIPE, text=True, check=True).stdout.strip()
+
+        stream = bytearray(f"reset refs/heads/{branch}\nfrom {tip}\n\n".encode())
+        for i in range(commits):
+            stream += self._commit(f"refs/heads/{branch}", i + 1, i if i > 0 else None, False)
+        subprocess.run(["git", "fast-import", "--quiet"], cwd=str(repository.path), input=bytes(stream), check=True)
+
+    def _commit(self, ref, mark, parent_mark, with_secret) -> bytes:
+        self._timestamp += 60
+        path = f"src/file-{self._random.randrange(self.files)}.txt"
+        content = self._content(with_secret)
+        message = f"Update {path}"
+
+        commit = bytearray()
+        commit += f"commit {ref}\nmark :{mark}\ncommitter Benchmark <benchmark@example.com> {self._timestamp} +0000\n".encode()
+        commit += f"data {len(message)}\n{message}\n".encode()
+        if parent_mark:
+            commit += f"from :{parent_mark}\n".encode()
+        commit += f"M 100644 inline {path}\ndata {len(content)}\n".encode() + content + b"\n\n"
+        return bytes(commit)
+
+    def _content(self, with_secret) -> bytes:
+        lines = []
+        size = 0
+        while size < self.blob_size:
+            line = " ".join(self._random.choice(words) for _ in range(10))
+            lines.append(line)
+            size += len(line) + 1
+
+        if with_secret:
+            key = "AKIA" + "".join(self._random.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+            lines.insert(self._random.randrange(len(lines) + 1), f'aws_access_key_id = "{key}"')
+
+        return ("\n".join(lines) + "\n").encode()
@@ -13,15 +13,13 @@ setup(
     include_package_data=True,
     package_data={'azure_devops_gitleaks_monitor': ['data/*']},
     install_requires=[
-        'azure-devops',
-        'GitPython',
         'python-dateutil',
         'pytz',
         'pyyaml',
         'requests',
         'toml',
+        'tomli; python_version < "3.11"',
         'pid',
-        'slack-sdk',
     ],
     entry_points={
         'console_scripts': ['azure-devops-gitleaks-monitor = azure_devops_gitleaks_monitor.main:main'],
@@ -1,56 +1,225 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Iterator
+from typing import Any, Dict, Iterator, Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote
 
 import dateutil.parser
 import pytz
 import requests
-from azure.devops.connection import Connection
-from msrest.authentication import BasicAuthentication
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
-from model import GitRepositoryInformation
+from model import GitRepositoryInformation, RepositorySelector
+from response_cache import ResponseCache
+from run_metrics import metrics
+from throttling_governor import ThrottlingGovernor
 
+LISTING_HEADERS = ("x-ms-continuationtoken",)
 
-class AzureDevopsConnector(object):
-    def __init__(self, organisation, password):
-        self._organization_url = f'https://dev.azure.com/{organisation}'
 
-        self._requests_auth = HTTPBasicAuth('', password)
-        credentials = BasicAuthentication('', password)
-        connection = Connection(base_url=self._organization_url, creds=credentials)
+class AzureDevopsConnector(object):
+    api_version = "6.0"
+    projects_page_size = 100
+    timeout = 60
+    response_cache: Optional[ResponseCache] = None
 
+    def __init__(self, organisation, password, max_concurrent_requests=8, url="https://dev.azure.com"):
+        self._url = url
+        self._organization_url = AzureDevopsConnector._get_organization_url(url, organisation)
         self._organisation = organisation
-        self._core_client = connection.clients.get_core_client()
-        self._git_client = connection.clients.get_git_client()
+        self._max_concurrent_requests = max_concurrent_requests
+        self._governor = ThrottlingGovernor.get(organisation, "rest", max_concurrent_requests)
+        self._missing_repositories: Set[str] = set()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_requests)
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth('', password)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
 
     def get_repos(self) -> Iterator[GitRepositoryInformation]:
-        for project in self._get_projects():
-            for repo in self._get_repositories(project.name):
-                yield GitRepositoryInformation(self._organisation, project.name, repo.name, repo.id, repo.remote_url)
+        projects = list(self._get_projects())
+        with ThreadPoolExecutor(max_workers=self._max_concurrent_requests) as executor:
+            for project, repositories in zip(projects, executor.map(self._get_repositories, projects)):
+                for repo in repositories:
+                    yield GitRepositoryInformation(self._organisation, project, repo["name"], repo["id"], repo["remoteUrl"])
+
+    def find_repos(self, project_pattern, repository_pattern="*") -> Iterator[GitRepositoryInformation]:
+        if RepositorySelector.is_pattern(project_pattern):
+            projects = [p for p in self._get_projects() if RepositorySelector.matches(project_pattern, p)]
+        else:
+            projects = [project_pattern]
+
+        if not RepositorySelector.is_pattern(repository_pattern):
+            with ThreadPoolExecutor(max_workers=self._max_concurrent_requests) as executor:
+                for project, repo in zip(projects, executor.map(lambda p: self._get_repository(p, repository_pattern), projects)):
+                    if repo:
+                        yield GitRepositoryInformation(self._organisation, repo["project"]["name"], repo["name"], repo["id"], repo["remoteUrl"])
+            return
+
+        with ThreadPoolExecutor(max_workers=self._max_concurrent_requests) as executor:
+            for project, repositories in zip(projects, executor.map(self._get_repositories, projects)):
+                for repo in repositories:
+                    if RepositorySelector.matches(repository_pattern, repo["name"]):
+                        yield GitRepositoryInformation(self._organisation, repo["project"]["name"], repo["name"], repo["id"], repo["remoteUrl"])
+
+    def get_repository(self, repository_id) -> Optional[GitRepositoryInformation]:
+        response = self._get(f"{self._organization_url}/_apis/git/repositories/{quote(repository_id)}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        repo = response.json()
+        if repo["id"].lower() != repository_id.lower():
+            return None
+        return GitRepositoryInformation(self._organisation, repo["project"]["name"], repo["name"], repo["id"], repo["remoteUrl"])
 
     def get_last_push_date(self, project_name, repository_id) -> datetime:
-        response = requests.get(
-            f"{self._organization_url}/{project_name}/_apis/git/repositories/{repository_id}/pushes?api-version=6.0&$top=1",
-            auth=self._requests_auth)
-        if response.status_code == 200:
-            j = response.json()
-            value = j.get("value")
-            if value and len(value) == 1:
-                return dateutil.parser.parse(value[0]["date"])
+        response = self._get(f"{self._organization_url}/{quote(project_name)}/_apis/git/repositories/{repository_id}/pushes",
+                             {"$top": 1})
+        response.raise_for_status()
+        value = response.json().get("value")
+        if value and len(value) == 1:
+            return dateutil.parser.parse(value[0]["date"])
         return datetime.min.replace(tzinfo=pytz.UTC)
 
+    def get_last_push_dates(self, repo_infos: Iterable[GitRepositoryInformation]) -> Dict[str, Optional[datetime]]:
+        repo_infos = list(repo_infos)
+        with ThreadPoolExecutor(max_workers=self._max_concurrent_requests) as executor:
+            dates = executor.map(self._get_last_push_date_safe, repo_infos)
+            return dict((repo_info.id, date) for repo_info, date in zip(repo_infos, dates))
+
     def get_branches(self, repository_id) -> Dict[str, str]:
-        return dict(("origin/" + branch.name, branch.commit.commit_id) for branch in self._git_client.get_branches(repository_id))
-
-    def _get_projects(self):
-        response = self._core_client.get_projects()
-        while response is not None:
-            for project in response.value:
-                yield project
-            if response.continuation_token is not None and response.continuation_token != "":
-                response = self._core_client.get_projects(continuation_token=response.continuation_token)
-            else:
+        branches = {}
+        continuation_token = None
+        while True:
+            params = {"filter": "heads/"}
+            if continuation_token:
+                params["continuationToken"] = continuation_token
+
+            response = self._get(f"{self._organization_url}/_apis/git/repositories/{repository_id}/refs", params)
+            response.raise_for_status()
+            for ref in response.json().get("value", []):
+                branches["origin/" + ref["name"][len("refs/heads/"):]] = ref["objectId"]
+
+            continuation_token = response.headers.get("x-ms-continuationtoken")
+            if not continuation_token:
+                return branches
+
+    def get_all_branches(self, repo_infos: Iterable[GitRepositoryInformation]) -> Dict[str, Optional[Dict[str, str]]]:
+        repo_infos = list(repo_infos)
+        with ThreadPoolExecutor(max_workers=self._max_concurrent_requests) as executor:
+            branches = list(executor.map(self._get_branches_safe, repo_infos))
+            return dict((repo_info.id, repo_branches) for repo_info, repo_branches in zip(repo_infos, branches)
+                        if repo_info.id not in self._missing_repositories)
+
+    @staticmethod
+    def invalidate_repositories(url, organisation, project_name):
+        if AzureDevopsConnector.response_cache:
+            organization_url = AzureDevopsConnector._get_organization_url(url, organisation)
+            AzureDevopsConnector.response_cache.invalidate(AzureDevopsConnector._get_repositories_url(organization_url, project_name))
+
+    def _get_last_push_date_safe(self, repo_info: GitRepositoryInformation) -> Optional[datetime]:
+        try:
+            return self.get_last_push_date(repo_info.project, repo_info.id)
+        except requests.RequestException as e:
+            logging.error(f"Could not fetch the last push date of {repo_info}: {e}")
+            metrics.increment("push_dates_failed")
+            return None
+
+    def _get_branches_safe(self, repo_info: GitRepositoryInformation) -> Optional[Dict[str, str]]:
+        try:
+            return self.get_branches(repo_info.id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                logging.error(f"Could not fetch the branches of {repo_info}: {e}")
+                return None
+            logging.warning(f"Repository {repo_info} was not found, it was renamed or deleted.")
+            self._missing_repositories.add(repo_info.id)
+            AzureDevopsConnector.invalidate_repositories(self._url, self._organisation, repo_info.project)
+            return None
+        except requests.RequestException as e:
+            logging.error(f"Could not fetch the branches of {repo_info}: {e}")
+            return None
+
+    def _get_projects(self) -> Iterator[str]:
+        continuation_token = None
+        while True:
+            params = {"$top": AzureDevopsConnector.projects_page_size}
+            if continuation_token:
+                params["continuationToken"] = continuation_token
+
+            body, headers = self._get_listing(self._get_projects_url(), params)
+            for project in body.get("value", []):
+                yield project["name"]
+
+            continuation_token = headers.get("x-ms-continuationtoken")
+            if not continuation_token:
                 break
 
-    def _get_repositories(self, project_name):
-        return self._git_client.get_repositories(project_name)
+    def _get_repositories(self, project_name) -> List[Dict]:
+        try:
+            body, _ = self._get_listing(AzureDevopsConnector._get_repositories_url(self._organization_url, project_name))
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            logging.warning(f"Project {self._organisation}/{project_name} was not found.")
+            if AzureDevopsConnector.response_cache:
+                AzureDevopsConnector.response_cache.invalidate(self._get_projects_url())
+            return []
+        return body.get("value", [])
+
+    def _get_repository(self, project_name, repository_name) -> Optional[Dict]:
+        response = self._get(f"{self._organization_url}/{quote(project_name)}/_apis/git/repositories/{quote(repository_name)}")
+        if response.status_code == 404:
+            logging.warning(f"Repository {self._organisation}/{project_name}/{repository_name} was not found.")
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def _get_listing(self, url, params=None) -> Tuple[Any, Dict[str, str]]:
+        cache = AzureDevopsConnector.response_cache
+        params = dict(params or {})
+        params["api-version"] = AzureDevopsConnector.api_version
+        cached = cache.get(url, params) if cache else None
+        if cached and cached.is_fresh():
+            metrics.increment("listings_cached")
+            return cached.body, cached.headers
+
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        response = self._get(url, params, headers)
+        if cached and response.status_code == 304:
+            metrics.increment("listings_not_modified")
+            cache.touch(url, params)
+            return cached.body, cached.headers
+
+        if response.status_code == 404 and cache:
+            cache.invalidate(url)
+        response.raise_for_status()
+        metrics.increment("listings_fetched")
+        body = response.json()
+        listing_headers = dict((name, response.headers[name]) for name in LISTING_HEADERS if name in response.headers)
+        if cache:
+            cache.save(url, params, response.headers.get("ETag"), response.headers.get("Last-Modified"), listing_headers, body)
+        return body, listing_headers
+
+    def _get_projects_url(self):
+        return f"{self._organization_url}/_apis/projects"
+
+    @staticmethod
+    def _get_organization_url(url, organisation):
+        return f'{url.rstrip("/")}/{quote(organisation)}'
+
+    @staticmethod
+    def _get_repositories_url(organization_url, project_name):
+        return f"{organization_url}/{quote(project_name)}/_apis/git/repositories"
+
+    def _get(self, url, params=None, headers=None) -> requests.Response:
+        params = dict(params or {})
+        params["api-version"] = AzureDevopsConnector.api_version
+        return self._governor.request(lambda: self._session.get(url, params=params, headers=headers, timeout=AzureDevopsConnector.timeout))
@@ -0,0 +1,404 @@
+import codecs
+import logging
+import math
+import os
+import re
+import subprocess
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from git_exception import GitException
+from rule_set import RuleSet
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+COMMIT_MARKER = "\0"
+COMMIT_FIELDS = 5
+INLINE_FLAGS = re.compile(r"\(\?([a-zA-Z]*-?[a-zA-Z]*)\)")
+FILE_ONLY_LINE_NUMBER = -1
+
+
+class DetectionRule(object):
+    def __init__(self, config: Dict[str, Any]):
+        self.description = config.get("description", "")
+        self.tags = ", ".join(config.get("tags", []))
+        self.regex = _compile(config["regex"]) if config.get("regex") else None
+        self.file = _compile(config["file"]) if config.get("file") else None
+        self.path = _compile(config["path"]) if config.get("path") else None
+        self.entropies = [(float(e.get("Min", 0)), float(e.get("Max", 0)), int(e.get("Group", 0))) for e in config.get("Entropies", [])]
+        self.allowlist = Allowlist(config.get("allowlist", {}))
+        self.keywords = _get_keywords(config["regex"]) if self.regex else None
+
+    def applies_to(self, path: str, name: str) -> bool:
+        if self.allowlist.allows_file(path, name):
+            return False
+        return (self.file is None or self.file.search(name) is not None) and (self.path is None or self.path.search(path) is not None)
+
+    def inspect(self, line: str) -> Tuple[Optional[str], float]:
+        match = self.regex.search(line)
+        if match is None or self.allowlist.allows_line(line):
+            return None, -1
+
+        if not self.entropies:
+            return match.group(0), -1
+
+        groups = match.groups()
+        for minimum, maximum, group in self.entropies:
+            if group <= len(groups):
+                entropy = _shannon_entropy(match.group(group) or "")
+                if minimum <= entropy <= maximum:
+                    return match.group(0), entropy
+        return None, -1
+
+
+class Allowlist(object):
+    def __init__(self, config: Dict[str, Any]):
+        self.regexes = [_compile(r) for r in config.get("regexes", [])]
+        self.files = [_compile(r) for r in config.get("files", [])]
+        self.paths = [_compile(r) for r in config.get("paths", [])]
+        self.commits = frozenset(config.get("commits", []))
+
+    def extend(self, other: 'Allowlist'):
+        self.regexes.extend(other.regexes)
+        self.files.extend(other.files)
+        self.paths.extend(other.paths)
+        self.commits = self.commits | other.commits
+
+    def allows_file(self, path: str, name: str) -> bool:
+        return any(r.search(name) for r in self.files) or any(r.search(path) for r in self.paths)
+
+    def allows_line(self, line: str) -> bool:
+        return any(r.search(line) for r in self.regexes)
+
+
+class DetectionRules(object):
+    _cache: Dict[Tuple[str, ...], 'DetectionRules'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, config_files: Iterable[Path]):
+        self.rules: List[DetectionRule] = []
+        self.allowlist = Allowlist({})
+        for config_file in config_files:
+            config = RuleSet.read(config_file)
+            self.rules.extend(DetectionRule(rule) for rule in config.get("rules", []))
+            self.allowlist.extend(Allowlist(config.get("allowlist", {})))
+
+    @staticmethod
+    def load(config_files: Iterable[Path]) -> 'DetectionRules':
+        key = tuple(str(f) for f in config_files)
+        with DetectionRules._lock:
+            rules = DetectionRules._cache.get(key)
+            if rules is None:
+                rules = DetectionRules._cache[key] = DetectionRules(key)
+            return rules
+
+    def get_file_rules(self, path: str) -> Tuple[List[DetectionRule], List[DetectionRule], Optional[re.Pattern]]:
+        name = os.path.basename(path)
+        if self.allowlist.allows_file(path, name):
+            return [], [], None
+
+        rules = [rule for rule in self.rules if rule.applies_to(path, name)]
+        file_rules = [rule for rule in rules if rule.regex is None]
+        line_rules = [rule for rule in rules if rule.regex is not None]
+
+        # A line can only match when it contains a keyword of one of the rules, unless a rule has none.
+        prefilter = None
+        if line_rules and all(rule.keywords for rule in line_rules):
+            keywords = sorted(set(k for rule in line_rules for k in rule.keywords), key=len, reverse=True)
+            prefilter = re.compile("|".join(re.escape(k) for k in keywords))
+        return file_rules, line_rules, prefilter
+
+
+class DetectionEngine(object):
+    max_file_size = 1024 * 1024
+    read_size = 64 * 1024
+
+    def __init__(self, repo_path, commits_to_scan: Optional[List[str]], config_file: Optional[Path], rules_file: Optional[Path] = None):
+        self._repo_path = repo_path
+        self._commits_to_scan = commits_to_scan
+        self._config_file = config_file
+        self._rules_file = rules_file or RuleSet.path
+
+    def detect(self) -> List[Dict[str, Any]]:
+        return list(self.execute())
+
+    def execute(self) -> Iterator[Dict[str, Any]]:
+        if self._commits_to_scan is not None and not self._commits_to_scan:
+            return
+
+        config_files = [self._rules_file]
+        if self._config_file:
+            config_files.append(self._config_file)
+        rules = DetectionRules.load(config_files)
+
+        process = self._start()
+        stdin_thread = threading.Thread(target=self._write_commits, args=(process,), daemon=True)
+        stdin_thread.start()
+        try:
+            yield from self._parse_log(process.stdout, rules)
+        finally:
+            if process.poll() is None:
+                process.kill()
+            stderr = process.stderr.read().decode("utf-8", errors="replace")
+            process.wait()
+            stdin_thread.join()
+
+        if process.returncode != 0:
+            raise GitException(f"Could not read the history of {self._repo_path}: {stderr.strip()}")
+
+    def _start(self) -> subprocess.Popen:
+        command = ["git", "-c", "core.quotePath=false", "log", "--patch", "--unified=0", "--no-color", "--no-renames",
+                   "--no-ext-diff", "--no-textconv", "--src-prefix=a/", "--dst-prefix=b/", "--diff-merges=first-parent",
+                   "--format=%x00%H%x00%an%x00%ae%x00%aI%x00%B%x00"]
+        if self._commits_to_scan is None:
+            command.append("--all")
+        else:
+            command.extend(("--no-walk=unsorted", "--stdin"))
+
+        logging.debug(command)
+        return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=str(self._repo_path),
+                                bufsize=DetectionEngine.read_size)
+
+    def _write_commits(self, process: subprocess.Popen):
+        try:
+            if self._commits_to_scan:
+                process.stdin.write("".join(f"{commit}\n" for commit in self._commits_to_scan).encode())
+            process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def _parse_log(self, stdout, rules: DetectionRules) -> Iterator[Dict[str, Any]]:
+        repo_name = Path(self._repo_path).name
+        commit = None
+        header = None
+        in_file_header = False
+        path = None
+        file_rules = line_rules = prefilter = None
+        file_size = 0
+        line_number = 0
+
+        for raw_line in stdout:
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+
+            if header is None and line.startswith(COMMIT_MARKER):
+                header = []
+                path = None
+            if header is not None:
+                header.append(line)
+                if sum(part.count(COMMIT_MARKER) for part in header) == COMMIT_FIELDS + 1:
+                    commit = _create_commit("\n".join(header)[1:-1], repo_name)
+                    header = None
+                continue
+
+            if commit is None or commit["commit"] in rules.allowlist.commits:
+                continue
+
+            if line.startswith("diff --git "):
+                in_file_header = True
+                path = None
+                continue
+
+            if in_file_header:
+                if line.startswith("+++ "):
+                    path = _parse_path(line[4:])
+                    file_rules, line_rules, prefilter = rules.get_file_rules(path) if path else (None, None, None)
+                    file_rules = [rule for rule in file_rules or [] if commit["commit"] not in rule.allowlist.commits]
+                    line_rules = [rule for rule in line_rules or [] if commit["commit"] not in rule.allowlist.commits]
+                    file_size = 0
+                elif line.startswith("@@ "):
+                    in_file_header = False
+                    line_number = _parse_hunk_start(line)
+                continue
+
+            if path is None:
+                continue
+
+            if line.startswith("@@ "):
+                line_number = _parse_hunk_start(line)
+                continue
+
+            if not line.startswith("+"):
+                continue
+
+            for rule in file_rules:
+                yield _create_finding(commit, rule, path, "", f"Filename or path offender: {path}", FILE_ONLY_LINE_NUMBER, -1)
+            file_rules = []
+
+            content = line[1:]
+            number = line_number
+            line_number += 1
+
+            file_size += len(raw_line)
+            if file_size > DetectionEngine.max_file_size:
+                logging.debug(f"Skipped the rest of {path} in {commit['commit']} because its changes exceed {DetectionEngine.max_file_size} bytes.")
+                path = None
+                continue
+
+            if not line_rules:
+                continue
+            lower = content.lower()
+            if prefilter is not None and prefilter.search(lower) is None:
+                continue
+
+            for rule in line_rules:
+                if rule.keywords and not any(k in lower for k in rule.keywords):
+                    continue
+                offender, entropy = rule.inspect(content)
+                if offender is not None and not rules.allowlist.allows_line(content):
+                    yield _create_finding(commit, rule, path, content, offender, number, entropy)
+
+
+def _create_commit(header: str, repo_name: str) -> Dict[str, Any]:
+    sha, author, email, date, message = header.split(COMMIT_MARKER, COMMIT_FIELDS - 1)
+    if date.endswith("+00:00"):
+        date = date[:-len("+00:00")] + "Z"
+    return {"commit": sha, "author": author, "email": email, "date": date, "commitMessage": message, "repo": repo_name}
+
+
+def _create_finding(commit: Dict[str, Any], rule: DetectionRule, path: str, line: str, offender: str, line_number: int, entropy: float) -> Dict[str, Any]:
+    return {
+        "line": line,
+        "lineNumber": line_number,
+        "offender": offender,
+        "offenderEntropy": entropy,
+        "commit": commit["commit"],
+        "repo": commit["repo"],
+        "repoURL": "",
+        "leakURL": "",
+        "rule": rule.description,
+        "commitMessage": commit["commitMessage"],
+        "author": commit["author"],
+        "email": commit["email"],
+        "file": path,
+        "date": commit["date"],
+        "tags": rule.tags,
+    }
+
+
+def _parse_path(value: str) -> Optional[str]:
+    if value.startswith('"'):
+        value = codecs.escape_decode(value[1:-1].encode("utf-8"))[0].decode("utf-8", errors="replace")
+    elif value.endswith("\t"):
+        # Git appends a tab to the names containing spaces.
+        value = value[:-1]
+    if not value.startswith("b/"):
+        return None
+    return value[2:]
+
+
+def _parse_hunk_start(line: str) -> int:
+    new_range = line.split(" ", 3)[2]
+    return int(new_range[1:].split(",", 1)[0])
+
+
+def _shannon_entropy(data: str) -> float:
+    if not data:
+        return 0
+    # Same as gitleaks, which divides the character counts by the length in bytes.
+    length = len(data.encode("utf-8"))
+    entropy = 0.0
+    for count in Counter(data).values():
+        frequency = count / length
+        entropy -= frequency * math.log2(frequency)
+    return entropy
+
+
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(_translate(pattern), re.ASCII)
+
+
+def _translate(pattern: str) -> str:
+    # Go allows inline flags anywhere, applying them to the end of the enclosing group, where Python only allows them at the start.
+    result = []
+    closings = [""]
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            escape = pattern[i:i + 2]
+            result.append("\\Z" if escape == "\\z" else escape)
+            i += 2
+            continue
+        if in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+            # A bracket right after the opening one is a literal.
+            prefix = "[^]" if pattern.startswith("[^]", i) else "[]" if pattern.startswith("[]", i) else "["
+            result.append(prefix)
+            i += len(prefix)
+            continue
+        elif c == "(":
+            flags = INLINE_FLAGS.match(pattern, i)
+            if flags and i > 0:
+                result.append(f"(?{flags.group(1)}:")
+                closings[-1] += ")"
+                i = flags.end()
+                continue
+            closings.append("")
+        elif c == ")" and len(closings) > 1:
+            result.append(closings.pop())
+        result.append(c)
+        i += 1
+    result.append(closings[0])
+    return "".join(result)
+
+
+def _get_keywords(pattern: str) -> Optional[FrozenSet[str]]:
+    try:
+        parsed = sre_parse.parse(_translate(pattern), re.ASCII)
+    except re.error:
+        return None
+    return _get_required_strings(parsed)
+
+
+def _get_required_strings(items) -> Optional[FrozenSet[str]]:
+    # Any match contains one of the returned strings, lowercased. The most selective set found is kept.
+    candidates = []
+    run = ""
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            run += chr(av).lower()
+            continue
+        if op == sre_parse.AT:
+            continue
+        previous_run = run
+        if run:
+            candidates.append(frozenset([run]))
+            run = ""
+
+        if op == sre_parse.SUBPATTERN:
+            candidates.append(_get_required_strings(av[-1]))
+        elif op == sre_parse.BRANCH:
+            alternatives = [_get_required_strings(alternative) for alternative in av[1]]
+            if all(alternatives):
+                candidates.append(frozenset().union(*alternatives))
+            # The common prefix of the alternatives is moved before the branch by the parser.
+            if previous_run:
+                candidates.append(frozenset(previous_run + _get_literal_prefix(alternative) for alternative in av[1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            candidates.append(_get_required_strings(av[2]))
+        elif op == sre_parse.IN and all(o == sre_parse.LITERAL for o, _ in av):
+            candidates.append(frozenset(chr(a).lower() for _, a in av))
+    if run:
+        candidates.append(frozenset([run]))
+
+    candidates = [c for c in candidates if c]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (min(len(k) for k in c), -len(c)))
+
+
+def _get_literal_prefix(items) -> str:
+    prefix = ""
+    for op, av in items:
+        if op != sre_parse.LITERAL:
+            break
+        prefix += chr(av).lower()
+    return prefix
@@ -0,0 +1,117 @@
+import csv
+import json
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+from model import RepositorySelector
+from scan_store import ScanStore
+
+REPORT_FIELDS = ["secret", "organization", "project", "repository", "file", "commit", "line_number", "rule", "date", "author",
+                 "occurrences", "last_commit", "last_date", "fingerprint"]
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+class FindingsReport(object):
+    formats = ("csv", "jsonl", "sarif")
+
+    def __init__(self, store: ScanStore):
+        self._store = store
+
+    def get_findings(self, selectors: Optional[List[RepositorySelector]] = None, rule_patterns: Optional[List[str]] = None,
+                     since: Optional[str] = None, before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        scans = dict((scan["repo_id"], scan) for scan in self._store.get_scans()
+                     if selectors is None or any(FindingsReport._matches(selector, scan) for selector in selectors))
+
+        rules = None
+        if rule_patterns is not None:
+            rules = [rule for rule in self._store.get_rules() if any(RepositorySelector.matches(pattern, rule) for pattern in rule_patterns)]
+
+        for finding in self._store.query_findings(scans.keys() if selectors is not None else None, rules, since, before):
+            scan = scans.get(finding["repo_id"]) or {}
+            finding["organization"] = scan.get("organization")
+            finding["project"] = scan.get("project_name")
+            finding["repository"] = scan.get("repo_name")
+            yield finding
+
+    def write(self, findings: Iterable[Dict[str, Any]], output_format: str, output: IO[str]) -> int:
+        if output_format == "csv":
+            return FindingsReport._write_csv(findings, output)
+        if output_format == "jsonl":
+            return FindingsReport._write_jsonl(findings, output)
+        return FindingsReport._write_sarif(findings, output)
+
+    @staticmethod
+    def _matches(selector: RepositorySelector, scan: Dict[str, Any]) -> bool:
+        return (RepositorySelector.matches(selector.organization, scan.get("organization") or "")
+                and RepositorySelector.matches(selector.project, scan.get("project_name") or "")
+                and RepositorySelector.matches(selector.repository, scan.get("repo_name") or ""))
+
+    @staticmethod
+    def _write_csv(findings: Iterable[Dict[str, Any]], output: IO[str]) -> int:
+        writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        count = 0
+        for finding in findings:
+            secret = finding["secret"]
+            writer.writerow({"secret": (secret.get("line") or "").strip() or secret.get("file"),
+                             "organization": finding["organization"],
+                             "project": finding["project"],
+                             "repository": finding["repository"],
+                             "file": secret.get("file"),
+                             "commit": finding["first_commit"],
+                             "line_number": secret.get("lineNumber"),
+                             "rule": secret.get("rule"),
+                             "date": finding["first_date"],
+                             "author": secret.get("author"),
+                             "occurrences": finding["occurrences"],
+                             "last_commit": finding["last_commit"],
+                             "last_date": finding["last_date"],
+                             "fingerprint": finding["fingerprint"]})
+            count += 1
+        return count
+
+    @staticmethod
+    def _write_jsonl(findings: Iterable[Dict[str, Any]], output: IO[str]) -> int:
+        count = 0
+        for finding in findings:
+            output.write(json.dumps(finding, separators=(",", ":")) + "\n")
+            count += 1
+        return count
+
+    @staticmethod
+    def _write_sarif(findings: Iterable[Dict[str, Any]], output: IO[str]) -> int:
+        # Results are streamed before the tool, which lists the rules found in them.
+        output.write(f'{{"$schema":"{SARIF_SCHEMA}","version":"2.1.0","runs":[{{"results":[')
+        rules: Dict[str, int] = {}
+        count = 0
+        for finding in findings:
+            secret = finding["secret"]
+            rule = secret.get("rule") or ""
+            rule_index = rules.setdefault(rule, len(rules))
+            location: Dict[str, Any] = {"artifactLocation": {"uri": secret.get("file") or ""}}
+            if (secret.get("lineNumber") or 0) > 0:
+                location["region"] = {"startLine": secret["lineNumber"]}
+
+            result = {
+                "ruleId": rule,
+                "ruleIndex": rule_index,
+                "level": "error",
+                "message": {"text": f"{rule} found in {finding['organization']}/{finding['project']}/{finding['repository']}."},
+                "locations": [{"physicalLocation": location}],
+                "partialFingerprints": {"secretFingerprint/v1": finding["fingerprint"]},
+                "properties": {"organization": finding["organization"],
+                               "project": finding["project"],
+                               "repository": finding["repository"],
+                               "commit": finding["first_commit"],
+                               "date": finding["first_date"],
+                               "author": secret.get("author"),
+                               "occurrences": finding["occurrences"],
+                               "leakUrl": secret.get("leakURL")},
+            }
+            output.write(("," if count else "") + json.dumps(result, separators=(",", ":")))
+            count += 1
+
+        driver = {"name": "azure-devops-gitleaks-monitor",
+                  "informationUri": "https://github.com/gsoft-inc/azure-devops-gitleaks-monitor",
+                  "rules": [{"id": rule, "shortDescription": {"text": rule}} for rule in rules]}
+        output.write(f'],"tool":{{"driver":{json.dumps(driver, separators=(",", ":"))}}}}}]}}\n')
+        return count
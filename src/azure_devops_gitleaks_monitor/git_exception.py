@@ -0,0 +1,4 @@
+class GitException(Exception):
+    def __init__(self, message, not_found=False):
+        super().__init__(message)
+        self.not_found = not_found
@@ -1,38 +1,70 @@
+import errno
 import json
 import logging
 import os
 import subprocess
 import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Iterable, Dict, Any
+from typing import Iterator, Dict, Any
 
 from gitleaks_exception import GitleaksException
+from rule_set import RuleSet
+from util import rmdir
 
 
 class GitleaksExecutor:
-    def __init__(self, repo_path, commits_file, config_file):
+    read_size = 64 * 1024
+    report_separators = " \t\r\n[],"
+
+    def __init__(self, repo_path, commits_file, config_file, rules_file=None):
         self._repo_path = repo_path
         self._commits_file = commits_file
         self._config_file = config_file
+        self._rules_file = rules_file or RuleSet.path
+
+    def execute(self) -> Iterator[Dict[str, Any]]:
+        report_path = tempfile.mkdtemp()
+        report_file = os.path.join(report_path, "report.json")
+        try:
+            if hasattr(os, "mkfifo"):
+                os.mkfifo(report_file)
+                yield from self._execute_streaming(report_file)
+            else:
+                self._wait(self._start(report_file))
+                if not os.path.exists(report_file):
+                    raise GitleaksException("Gitleaks did not complete successfully.")
+                with open(report_file, "r") as f:
+                    yield from self._parse_report(f)
+        finally:
+            rmdir(report_path)
+
+    def _execute_streaming(self, report_file):
+        process = self._start(report_file)
+        report_opened = threading.Event()
+        error_occurred = []
+
+        log_thread = threading.Thread(target=lambda: error_occurred.append(self._wait(process, raise_on_error=False)))
+        log_thread.start()
+        threading.Thread(target=self._release_report, args=(process, report_file, report_opened), daemon=True).start()
 
-    def execute(self) -> Iterable[Dict[str, Any]]:
-        report_file = tempfile.mktemp()
         try:
-            self._execute_internal(report_file)
-            if not os.path.exists(report_file):
-                raise GitleaksException("Gitleaks did not complete successfully.")
             with open(report_file, "r") as f:
-                return json.load(f) or []
+                report_opened.set()
+                received = yield from self._parse_report(f)
         finally:
-            if os.path.exists(report_file):
-                os.remove(report_file)
+            if process.poll() is None:
+                process.kill()
+            log_thread.join()
 
-    def _execute_internal(self, report_file):
-        global_config_file = Path(__file__).parent / "data/gitleaks-rules.toml"
+        if any(error_occurred) or not received:
+            raise GitleaksException("Gitleaks did not complete successfully.")
 
+    def _start(self, report_file) -> subprocess.Popen:
         command = ["gitleaks",
                    "--path", self._repo_path,
-                   "--config-path", global_config_file,
+                   "--config-path", self._rules_file,
                    "-o", report_file]
 
         if self._commits_file:
@@ -45,8 +77,11 @@ class GitleaksExecutor:
 
         logging.debug(command)
 
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=Path(__file__).parent)
+
+    def _wait(self, process: subprocess.Popen, raise_on_error=True) -> bool:
         error_occurred = False
-        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=Path(__file__).parent) as p:
+        with process as p:
             while p.poll() is None:
                 line = p.stdout.readline().strip()
                 if line:
@@ -56,8 +91,56 @@ class GitleaksExecutor:
             if line:
                 error_occurred |= self._handle_log(line)
 
-        if error_occurred:
+        if error_occurred and raise_on_error:
             raise GitleaksException("Gitleaks did not complete successfully.")
+        return error_occurred
+
+    @staticmethod
+    def _release_report(process: subprocess.Popen, report_file, report_opened: threading.Event):
+        # Unblocks the reader when gitleaks exits without ever opening the report.
+        process.wait()
+        while not report_opened.is_set():
+            try:
+                os.close(os.open(report_file, os.O_WRONLY | os.O_NONBLOCK))
+                return
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    return
+                time.sleep(0.1)
+
+    @staticmethod
+    def _parse_report(f):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        received = False
+
+        while True:
+            chunk = f.read(GitleaksExecutor.read_size)
+            received |= bool(chunk)
+            buffer += chunk
+
+            position = 0
+            while True:
+                while position < len(buffer) and buffer[position] in GitleaksExecutor.report_separators:
+                    position += 1
+                if position >= len(buffer):
+                    break
+                if buffer.startswith("null", position):
+                    position += 4
+                    continue
+                try:
+                    secret, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break
+                yield secret
+
+            buffer = buffer[position:]
+            if not chunk:
+                break
+
+        if buffer.strip():
+            raise GitleaksException("Gitleaks report could not be parsed.")
+        return received
 
     @staticmethod
     def _handle_log(line):
@@ -2,62 +2,474 @@
 import argparse
 import csv
 import logging
-from contextlib import nullcontext
+import multiprocessing
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext, contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Iterable, Any, Tuple, List
+from typing import Dict, Iterable, Any, Tuple, List, Optional, Callable
 
-from pid import PidFile
-from slack_sdk.errors import SlackRequestError
-from slack_sdk.webhook import WebhookClient
+import dateutil.parser
 
 from azure_devops_connector import AzureDevopsConnector
 from config_loader import load_configuration
+from findings_report import FindingsReport
+from git_exception import GitException
 from git_repository import GitRepository
-from model import Configuration, GitRepositoryConfiguration, GitRepositoryInformation
+from model import Configuration, GitRepositoryConfiguration, GitRepositoryInformation, OrganizationConfiguration, RepositorySelector
+from repository_cache import RepositoryCache
+from response_cache import ResponseCache
+from run_metrics import metrics, Profiler
+from scan_scheduler import ScanScheduler
+from scan_store import ScanStore, SqliteScanStore
 from scanner import Scanner
+from slack_delivery_queue import SlackDeliveryQueue
 from slack_message_builder import SlackMessageBuilder
+from throttling_governor import ThrottlingGovernor
+from util import parse_size, parse_duration
+from work_queue import WorkQueue, WorkItem, SqliteWorkQueue
 
+SECRETS_BATCH_SIZE = 100
+DEFAULT_SCAN_COST = 60
+POLL_INTERVAL = 5
 
-def scan(config: Configuration, output_all: bool) -> Iterable[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]]:
+
+def scan(config: Configuration, output_all: bool, workers: int = 1, selectors: Optional[List[RepositorySelector]] = None,
+         time_budget: Optional[float] = None) -> Iterable[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]]:
+    deadline = time.monotonic() + time_budget if time_budget else None
+    results = queue.Queue()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        jobs = 0
+        budgeted_jobs = []
+        for org_config, org_selectors in select_organizations(config, selectors):
+            connector = AzureDevopsConnector(org_config.name, org_config.password, org_config.max_concurrent_requests, org_config.url)
+            for repo_info, repo_config, last_push, remote_branches in list_repositories(connector, org_config, org_selectors):
+                if deadline is not None:
+                    budgeted_jobs.append((org_config, repo_config, repo_info, last_push, remote_branches))
+                    continue
+
+                executor.submit(metrics.profile, scan_repository, org_config, repo_config, repo_info,
+                                last_push, remote_branches, output_all, results.put)
+                jobs += 1
+
+        if deadline is not None and time.monotonic() >= deadline:
+            logging.info(f"Deferred {len(budgeted_jobs)} repositories to the next run because listing them exhausted the time budget.")
+            metrics.increment("repositories_deferred", len(budgeted_jobs))
+        elif deadline is not None:
+            for (org_config, repo_config, repo_info, last_push, remote_branches), start_before in plan_repositories(budgeted_jobs, deadline):
+                executor.submit(metrics.profile, scan_repository, org_config, repo_config, repo_info,
+                                last_push, remote_branches, output_all, results.put, start_before)
+                jobs += 1
+
+        while jobs > 0:
+            result = results.get()
+            if result is None:
+                jobs -= 1
+            else:
+                yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def plan_repositories(jobs: List[Tuple[OrganizationConfiguration, GitRepositoryConfiguration, GitRepositoryInformation, Optional[datetime], Optional[Dict[str, str]]]],
+                      deadline: Optional[float]) -> List[Tuple[Tuple[Any, ...], float]]:
+    checks = Scanner.store.get_checks()
+    durations = [duration for _, duration in checks.values() if duration is not None]
+    default_cost = sum(durations) / len(durations) if durations else DEFAULT_SCAN_COST
+
+    planned = []
+    for job in jobs:
+        _, repo_config, repo_info, last_push, remote_branches = job
+        last_checked, duration = checks.get(repo_info.id, (None, None))
+        last_scan_date = (Scanner.store.get_scan(repo_info.id) or {}).get("date")
+
+        if remote_branches is not None:
+            changed = remote_branches != Scanner.store.get_refs(repo_info.id)
+        else:
+            changed = not last_scan_date or last_push is None or last_push > dateutil.parser.isoparse(last_scan_date)
+        changed = changed or Scanner.is_outdated(repo_info, repo_config)
+
+        # A repository slower than the whole budget can still start, but only at the beginning of a run.
+        cost = min(duration if duration is not None else default_cost, max(0.0, deadline - time.monotonic()) * 0.9) if changed else 0
+        staleness = dateutil.parser.isoparse(last_checked).timestamp() if last_checked else 0
+        push_recency = last_push.timestamp() if last_push else 0
+        planned.append(((not changed, staleness, -push_recency), job, deadline - cost))
+
+    planned.sort(key=lambda p: p[0])
+    logging.info(f"{sum(1 for key, _, _ in planned if not key[0])} repositories changed since their last scan, "
+                 f"estimated to take {sum(deadline - start_before for _, _, start_before in planned):.0f}s out of {max(0.0, deadline - time.monotonic()):.0f}s.")
+    return [(job, start_before) for _, job, start_before in planned]
+
+
+def scan_continuously(config_file: str, output_all: bool, workers: int = 1, listen: Optional[str] = None,
+                      on_sweep: Optional[Callable[[], Any]] = None) -> Iterable[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]]:
+    config = load_configuration(config_file)
+    connectors = create_connectors(config)
+    scheduler = ScanScheduler(workers)
+    # The signal handlers put into this queue, SimpleQueue.put being reentrant unlike Queue.put which may already hold its lock.
+    results = queue.SimpleQueue()
+    stopped = threading.Event()
+    reload_requested = threading.Event()
+    next_sweeps: Dict[str, float] = {}
+
+    def request(event):
+        def handler(signum, frame):
+            event.set()
+            results.put(None)
+        return handler
+
+    def run_job(org_config, repo_info, args):
+        def output(result):
+            if result is None:
+                scheduler.done(org_config, repo_info)
+            results.put(result)
+        metrics.profile(scan_repository, org_config, args[0], repo_info, args[1], args[2], output_all, output)
+
+    def on_push(org_config, repo_info, date, ref_updates):
+        previous_scan = Scanner.store.get_scan(repo_info.id) or {}
+        if previous_scan.get("repo_name") not in (None, repo_info.name) or previous_scan.get("project_name") not in (None, repo_info.project):
+            logging.info(f"Repository {previous_scan.get('project_name')}/{previous_scan.get('repo_name')} was renamed to {repo_info}.")
+            AzureDevopsConnector.invalidate_repositories(org_config.url, org_config.name, previous_scan.get("project_name"))
+            AzureDevopsConnector.invalidate_repositories(org_config.url, org_config.name, repo_info.project)
+
+        remote_branches = None
+        previous_branches = Scanner.store.get_refs(repo_info.id)
+        if previous_branches:
+            remote_branches = dict(previous_branches)
+            for name, sha in ref_updates.items():
+                if sha is None:
+                    remote_branches.pop(name, None)
+                else:
+                    remote_branches[name] = sha
+
+        repo_config = org_config.get_repository(repo_info.project, repo_info.name)
+        if scheduler.schedule(ScanScheduler.get_priority(date, previous_scan.get("date")), org_config, repo_info, repo_config, date, remote_branches):
+            results.put(None)
+
+    previous_handlers = dict((signum, signal.signal(signum, request(event)))
+                             for signum, event in ((signal.SIGHUP, reload_requested), (signal.SIGTERM, stopped), (signal.SIGINT, stopped)))
+    receiver = None
+    if listen:
+        from push_event_receiver import PushEventReceiver
+        receiver = PushEventReceiver(listen, config.organizations, lambda org_config, repo_id: connectors[org_config.name].get_repository(repo_id), on_push)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if receiver:
+            receiver.start()
+
+        while not stopped.is_set():
+            if reload_requested.is_set():
+                reload_requested.clear()
+                logging.info("Reloading configuration...")
+                try:
+                    config = load_configuration(config_file)
+                    connectors = create_connectors(config)
+                    next_sweeps.clear()
+                    if receiver:
+                        receiver.organizations = config.organizations
+                except Exception as e:
+                    logging.error(f"Could not reload the configuration, the previous one is kept: {e}")
+
+            swept = False
+            for org_config in config.organizations:
+                if next_sweeps.get(org_config.name, 0) <= time.monotonic():
+                    next_sweeps[org_config.name] = time.monotonic() + org_config.scan_interval
+                    swept = True
+                    try:
+                        schedule_repositories(scheduler, connectors[org_config.name], org_config)
+                    except Exception as e:
+                        logging.exception(e)
+            if swept and on_sweep:
+                on_sweep()
+
+            job = scheduler.next()
+            while job is not None:
+                executor.submit(run_job, *job)
+                job = scheduler.next()
+
+            try:
+                result = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if result is not None:
+                yield result
+
+        logging.info(f"Stopping, waiting for {scheduler.running} scans in progress...")
+    finally:
+        if receiver:
+            receiver.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    while not results.empty():
+        result = results.get()
+        if result is not None:
+            yield result
+
+
+def create_connectors(config: Configuration) -> Dict[str, AzureDevopsConnector]:
+    return dict((org_config.name, AzureDevopsConnector(org_config.name, org_config.password, org_config.max_concurrent_requests, org_config.url))
+                for org_config in config.organizations)
+
+
+def schedule_repositories(scheduler: ScanScheduler, connector: AzureDevopsConnector, org_config: OrganizationConfiguration):
+    scheduled = 0
+    for repo_info, repo_config, last_push, remote_branches in list_repositories(connector, org_config):
+        if remote_branches is not None and remote_branches == Scanner.store.get_refs(repo_info.id) and not Scanner.is_outdated(repo_info, repo_config):
+            continue
+
+        last_scan_date = (Scanner.store.get_scan(repo_info.id) or {}).get("date")
+        if scheduler.schedule(ScanScheduler.get_priority(last_push, last_scan_date), org_config, repo_info, repo_config, last_push, remote_branches):
+            scheduled += 1
+    logging.info(f"Scheduled {scheduled} repositories from {org_config.name} organization, {len(scheduler)} waiting.")
+
+
+def select_organizations(config: Configuration, selectors: Optional[List[RepositorySelector]]) -> Iterable[Tuple[OrganizationConfiguration, Optional[List[RepositorySelector]]]]:
+    if selectors is None:
+        return [(org_config, None) for org_config in config.organizations]
+
+    organizations = []
     for org_config in config.organizations:
-        connector = AzureDevopsConnector(org_config.name, org_config.password)
+        org_selectors = [s for s in selectors if RepositorySelector.matches(s.organization, org_config.name)]
+        if org_selectors:
+            organizations.append((org_config, org_selectors))
 
-        logging.info(f"Fetching repos from {org_config.name} organization...")
-        repo_infos = list(connector.get_repos())
-        logging.info("Repos fetched.")
+    for selector in selectors:
+        if not any(selector in org_selectors for _, org_selectors in organizations):
+            logging.warning(f"{selector} does not match any configured organization.")
+    return organizations
 
-        for repo_info in repo_infos:
-            repo_config = org_config.get_project(repo_info.project).get_repository(repo_info.name)
+
+def list_repositories(connector: AzureDevopsConnector, org_config: OrganizationConfiguration,
+                      selectors: Optional[List[RepositorySelector]] = None) -> List[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, Optional[datetime], Optional[Dict[str, str]]]]:
+    logging.info(f"Fetching repos from {org_config.name} organization...")
+    repo_infos = []
+    with metrics.time("enumeration"):
+        if selectors is None:
+            found_repo_infos = connector.get_repos()
+        else:
+            found_repo_infos = dict((repo_info.id, repo_info) for selector in selectors
+                                    for repo_info in connector.find_repos(selector.project, selector.repository)).values()
+
+        for repo_info in found_repo_infos:
+            repo_config = org_config.get_repository(repo_info.project, repo_info.name)
             if repo_config.skip:
                 logging.debug(f"Skipped {repo_info}.")
                 continue
+            repo_infos.append((repo_info, repo_config))
+    metrics.increment("repositories", len(repo_infos))
+    logging.info("Repos fetched.")
+
+    logging.info(f"Fetching branches from {org_config.name} organization...")
+    with metrics.time("branches"):
+        remote_branches = connector.get_all_branches(repo_info for repo_info, _ in repo_infos)
+    listed = len(repo_infos)
+    repo_infos = [(repo_info, repo_config) for repo_info, repo_config in repo_infos if repo_info.id in remote_branches]
+    metrics.increment("repositories_missing", listed - len(repo_infos))
+    logging.info("Branches fetched.")
+
+    logging.info(f"Fetching last push dates from {org_config.name} organization...")
+    with metrics.time("push_dates"):
+        last_pushes = connector.get_last_push_dates(repo_info for repo_info, _ in repo_infos
+                                                    if remote_branches[repo_info.id] is None or not Scanner.store.get_refs(repo_info.id))
+    logging.info("Last push dates fetched.")
+
+    return [(repo_info, repo_config, last_pushes.get(repo_info.id), remote_branches[repo_info.id]) for repo_info, repo_config in repo_infos]
+
+
+def scan_repository(org_config: OrganizationConfiguration,
+                    repo_config: GitRepositoryConfiguration,
+                    repo_info: GitRepositoryInformation,
+                    last_push: Optional[datetime],
+                    remote_branches: Optional[Dict[str, str]],
+                    output_all: bool,
+                    output: Callable[[Optional[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]]], None],
+                    start_before: Optional[float] = None):
+    if start_before is not None and time.monotonic() > start_before:
+        logging.info(f"Deferred {repo_info} to the next run because it would not complete within the time budget.")
+        metrics.increment("repositories_deferred")
+        output(None)
+        return
+
+    logging.info(f"Processing {repo_info}...")
+    started = time.perf_counter()
+    try:
+        scanner = Scanner(org_config, repo_config, repo_info)
+
+        if scanner.should_scan(last_push, remote_branches):
+            logging.debug(f"Starting scan for {repo_info}...")
+            metrics.increment("repositories_scanned")
+            batch = []
+            for secret in scanner.scan():
+                if output_all:
+                    continue
+                batch.append(secret)
+                if len(batch) >= SECRETS_BATCH_SIZE:
+                    output((repo_info, repo_config, batch))
+                    batch = []
+            scanner.save()
+            Scanner.store.save_check(repo_info.id, time.perf_counter() - started)
+            if batch:
+                output((repo_info, repo_config, batch))
+        else:
+            logging.info(f"Skipped {repo_info} because there were no new pushes.")
+            metrics.increment("repositories_skipped")
+            Scanner.store.save_check(repo_info.id)
+
+        if output_all:
+            output((repo_info, repo_config, scanner.get_all_secrets()))
+
+    except GitException as e:
+        if not e.not_found:
+            logging.exception(e)
+            metrics.increment("repositories_failed")
+        else:
+            # The repository was renamed or deleted since the listing was cached.
+            logging.warning(f"Repository {repo_info} was not found, it was renamed or deleted.")
+            metrics.increment("repositories_missing")
+            AzureDevopsConnector.invalidate_repositories(org_config.url, org_config.name, repo_info.project)
 
-            logging.info(f"Processing {repo_info}...")
+    except Exception as e:
+        logging.exception(e)
+        metrics.increment("repositories_failed")
+
+    finally:
+        metrics.record("repository", time.perf_counter() - started, repo_info)
+        logging.info(f"Processed {repo_info}.")
+        output(None)
+
+
+def coordinate(config: Configuration, output_all: bool, work_queue: WorkQueue,
+               selectors: Optional[List[RepositorySelector]] = None) -> Iterable[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]]:
+    published = 0
+    for org_config, org_selectors in select_organizations(config, selectors):
+        connector = AzureDevopsConnector(org_config.name, org_config.password, org_config.max_concurrent_requests, org_config.url)
+        for repo_info, repo_config, last_push, remote_branches in list_repositories(connector, org_config, org_selectors):
+            if not output_all and remote_branches is not None and remote_branches == Scanner.store.get_refs(repo_info.id) and not Scanner.is_outdated(repo_info, repo_config):
+                continue
+
+            last_scan_date = (Scanner.store.get_scan(repo_info.id) or {}).get("date")
+            work_queue.publish(WorkItem(org_config.name, repo_info, last_push, remote_branches, output_all), ScanScheduler.get_priority(last_push, last_scan_date))
+            published += 1
+    logging.info(f"Published {published} repositories, waiting for the workers...")
+
+    organizations = dict((org_config.name, org_config) for org_config in config.organizations)
+    while True:
+        for repo_info in work_queue.get_failures():
+            logging.error(f"Scan of {repo_info} failed, the workers lost its lease too many times.")
+            metrics.increment("repositories_failed")
+
+        remaining = work_queue.count_remaining()
+        for repo_info, secrets in work_queue.get_results():
+            org_config = organizations[repo_info.organization]
+            yield repo_info, org_config.get_repository(repo_info.project, repo_info.name), secrets
+
+        if remaining == 0:
+            break
+        time.sleep(POLL_INTERVAL)
+
+
+def work(config: Configuration, work_queue: WorkQueue, worker_name: str, workers: int = 1):
+    organizations = dict((org_config.name, org_config) for org_config in config.organizations)
+    stopped = threading.Event()
+
+    def stop(signum, frame):
+        logging.info("Stopping, waiting for the scans in progress...")
+        stopped.set()
+
+    previous_handlers = dict((signum, signal.signal(signum, stop)) for signum in (signal.SIGTERM, signal.SIGINT))
+    try:
+        logging.info(f"Worker {worker_name} waiting for repositories to scan...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in range(workers):
+                executor.submit(process_work_items, organizations, work_queue, worker_name, stopped)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def process_work_items(organizations: Dict[str, OrganizationConfiguration], work_queue: WorkQueue, worker_name: str, stopped: threading.Event):
+    while not stopped.is_set():
+        try:
+            item = work_queue.claim(worker_name)
+            if item is None:
+                stopped.wait(POLL_INTERVAL)
+                continue
+
+            results = []
+            org_config = organizations.get(item.organization)
+            if org_config is None:
+                logging.error(f"{item.repo_info} belongs to an organization missing from the configuration of this worker.")
+                work_queue.complete(item, results)
+                continue
+
+            def output(result):
+                if result is not None:
+                    results.append(result[2])
+
+            done = threading.Event()
+
+            def renew_lease():
+                while not done.wait(WorkQueue.lease_duration / 3):
+                    if not work_queue.renew(item):
+                        logging.warning(f"Lease on {item.repo_info} was lost, another worker may scan it again.")
+                        return
+
+            threading.Thread(target=renew_lease, name="lease-renewal", daemon=True).start()
             try:
-                scanner = Scanner(org_config, repo_config, repo_info)
-                last_push = connector.get_last_push_date(repo_info.project, repo_info.id)
-                new_secrets = []
-
-                if scanner.should_scan(last_push):
-                    logging.debug(f"Starting scan for {repo_info}...")
-                    new_secrets = scanner.scan()
-                    scanner.save()
-                else:
-                    logging.info(f"Skipped {repo_info} because there were no new pushes.")
+                metrics.profile(scan_repository, org_config, org_config.get_repository(item.repo_info.project, item.repo_info.name), item.repo_info,
+                                item.last_push, item.remote_branches, item.output_all, output)
+            finally:
+                done.set()
+            work_queue.complete(item, results)
+        except Exception as e:
+            logging.exception(e)
+            stopped.wait(POLL_INTERVAL)
+
 
-                yield repo_info, repo_config, scanner.get_all_secrets() if output_all else new_secrets
+def execute(config: Configuration, output_all: bool, output_file: str, output_slack: bool, workers: int = 1,
+            selectors: Optional[List[RepositorySelector]] = None, time_budget: Optional[float] = None):
+    slack = SlackDeliveryQueue() if output_slack else None
+    try:
+        write_results(scan(config, output_all, workers, selectors, time_budget), output_file, slack)
+    finally:
+        if slack:
+            slack.close()
 
-            except Exception as e:
-                logging.exception(e)
 
-            logging.info(f"Processed {repo_info}.")
+def execute_continuously(config_file: str, output_all: bool, output_file: str, output_slack: bool, workers: int = 1, listen: Optional[str] = None):
+    slack = SlackDeliveryQueue() if output_slack else None
+    try:
+        write_results(scan_continuously(config_file, output_all, workers, listen, slack.resend_pending if slack else None), output_file, slack)
+    finally:
+        if slack:
+            slack.close()
 
 
-def execute(config: Configuration, output_all: bool, output_file: str, output_slack: bool):
+def execute_coordinator(config: Configuration, output_all: bool, output_file: str, output_slack: bool, work_queue: WorkQueue,
+                        selectors: Optional[List[RepositorySelector]] = None):
+    slack = SlackDeliveryQueue() if output_slack else None
+    try:
+        write_results(coordinate(config, output_all, work_queue, selectors), output_file, slack)
+    finally:
+        if slack:
+            slack.close()
+
+
+def write_results(results: Iterable[Tuple[GitRepositoryInformation, GitRepositoryConfiguration, List[Dict[str, Any]]]],
+                  output_file: str, slack: Optional[SlackDeliveryQueue]):
     with open(output_file, "w", newline='') as f:
         writer = csv.DictWriter(f, fieldnames=["secret", "project", "repository", "file", "commit"])
         writer.writeheader()
-        for repo_info, repo_config, secrets in scan(config, output_all):
+        for repo_info, repo_config, secrets in results:
             for secret in secrets:
                 row = {"secret": secret["line"].strip() or secret["file"],
                        "project": repo_info.project,
@@ -66,13 +478,84 @@ def execute(config: Configuration, output_all: bool, output_file: str, output_sl
                        "commit": secret["commit"]}
                 print(row)
                 writer.writerow(row)
+            f.flush()
 
-            if output_slack and repo_config.slack_webhook:
-                webhook = WebhookClient(repo_config.slack_webhook)
+            if slack and repo_config.slack_webhook:
                 for blocks in SlackMessageBuilder(repo_info, secrets).build():
-                    response = webhook.send(text="fallback", blocks=blocks)
-                    if response.status_code != 200:
-                        raise SlackRequestError(f"Error when sending message blocks to slack: {response.body}")
+                    slack.send(repo_config.slack_webhook, blocks)
+
+
+def write_metrics(json_file: Optional[str], prometheus_file: Optional[str], profile_file: Optional[str]):
+    report = metrics.to_dict()
+    logging.info(f"Run completed in {report['duration']:.1f}s: " + ", ".join(f"{phase} {totals['seconds']:.1f}s"
+                                                                              for phase, totals in report["phases"].items()))
+    for governor in ThrottlingGovernor.get_all():
+        if governor.throttled or governor.retried:
+            logging.warning(f"Azure DevOps throttling of {governor.traffic} traffic of {governor.name} organization: {governor.throttled} throttled responses, {governor.retried} retries, "
+                            f"{governor.waited:.1f}s waited, concurrency lowered to {governor.min_limit}/{governor.max_concurrency}.")
+    if json_file:
+        metrics.write_json(Path(json_file))
+    if prometheus_file:
+        metrics.write_prometheus(Path(prometheus_file))
+    if profile_file and metrics.profiler:
+        metrics.profiler.dump(Path(profile_file))
+
+
+def report(store: ScanStore, output_file: str, output_format: str, selectors: Optional[List[RepositorySelector]] = None,
+           rules: Optional[List[str]] = None, since: Optional[str] = None, before: Optional[str] = None):
+    started = time.perf_counter()
+    findings = FindingsReport(store)
+    with open(output_file, "w", newline='') if output_file != "-" else nullcontext(sys.stdout) as f:
+        count = findings.write(findings.get_findings(selectors, rules, since, before), output_format, f)
+    logging.info(f"Reported {count} secrets in {time.perf_counter() - started:.1f}s.")
+
+
+def open_store(cache_path: Path, shared_path: Optional[Path] = None) -> SqliteScanStore:
+    results_path = cache_path / "results"
+    results_path.mkdir(parents=True, exist_ok=True)
+    if shared_path:
+        shared_path.mkdir(parents=True, exist_ok=True)
+        return SqliteScanStore(shared_path / "scans.db", shared=True)
+    return SqliteScanStore(results_path / "scans.db")
+
+
+@contextmanager
+def open_cache(cache_path: Path, repo_cache_size: Optional[int] = None, shared_path: Optional[Path] = None):
+    results_path = cache_path / "results"
+    Scanner.store = open_store(cache_path, shared_path)
+    Scanner.allowlists_path = cache_path / "allowlists"
+    Scanner.allowlists_path.mkdir(parents=True, exist_ok=True)
+    SlackDeliveryQueue.outbox_path = cache_path / "slack-outbox"
+    SlackDeliveryQueue.outbox_path.mkdir(parents=True, exist_ok=True)
+    GitRepository.cache = RepositoryCache(cache_path / "repos", repo_cache_size)
+    AzureDevopsConnector.response_cache = ResponseCache(cache_path / "responses.db")
+    try:
+        Scanner.store.migrate_json_results(results_path)
+        yield
+    finally:
+        AzureDevopsConnector.response_cache.close()
+        AzureDevopsConnector.response_cache = None
+        GitRepository.cache.close()
+        Scanner.store.close()
+
+
+def parse_selector(value: str, with_repository: bool = True) -> RepositorySelector:
+    try:
+        return RepositorySelector.parse(value, with_repository)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_project_selector(value: str) -> RepositorySelector:
+    return parse_selector(value, False)
+
+
+def parse_date(value: str) -> str:
+    try:
+        date = dateutil.parser.isoparse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return (date if date.tzinfo else date.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
 
 
 def main():
@@ -84,30 +567,106 @@ def main():
     parser.add_argument('--all', '-a', action="store_true", dest='output_all', default=False, help="Also outputs the previously found results.")
     parser.add_argument('--output', '-o', action="store", dest='output_file', default="/dev/null", help="File where a CSV report will be saved. Defaults to /dev/null")
     parser.add_argument('--slack', '-s', action="store_true", dest='output_slack', default=False, help="Send slack notifications to the configured webhooks when secrets are found.")
+    parser.add_argument('--repo', '-r', action="append", dest='repos', type=parse_selector, default=None, help="Only scan the repositories matching organization/project/repository. Each part can be a glob pattern (e.g. MyOrg/*/api-*). Can be repeated.")
+    parser.add_argument('--project', '-p', action="append", dest='projects', type=parse_project_selector, default=None, help="Only scan the repositories of the projects matching organization/project. Each part can be a glob pattern. Can be repeated.")
+    parser.add_argument('--workers', '-w', action="store", dest='workers', type=int, default=1, help="Number of repositories scanned in parallel. Defaults to 1.")
+    parser.add_argument('--time-budget', action="store", dest='time_budget', type=parse_duration, default=None, help="Stop starting new scans when they would not complete within this duration (e.g. 45m, 2h). Repositories are taken by staleness so the following runs resume with the ones left.")
+    parser.add_argument('--repo-cache-size', action="store", dest='repo_cache_size', type=parse_size, default=None, help="Keep cloned repositories between runs up to this disk budget (e.g. 50G), evicting the least recently used ones first. By default, only persisted repositories are kept.")
+    parser.add_argument('--maintenance-interval', action="store", dest='maintenance_interval', type=parse_duration, default=GitRepository.maintenance_interval, help=f"Duration (e.g. 12h, 7d) between two maintenances (commit-graph, repack of loose objects and packs) of the kept repositories. Maintenance also runs when a repository has too many loose objects or packs. 0 only runs it in this case. Defaults to {GitRepository.maintenance_interval // 86400}d.")
+    parser.add_argument('--listing-ttl', action="store", dest='listing_ttl', type=parse_duration, default=ResponseCache.ttl, help="Duration (e.g. 30m, 6h) during which the cached lists of projects and repositories are used without asking Azure DevOps. Afterwards, they are only downloaded again when they changed. Defaults to 0.")
+    parser.add_argument('--engine', action="store", dest='engine', choices=("gitleaks", "native"), default=Scanner.engine, help="Engine detecting the secrets. native matches the gitleaks rules in process on the output of git log, skipping binary files and changes larger than 1 MB. Defaults to gitleaks.")
+    parser.add_argument('--shards', action="store", dest='shards', type=int, default=Scanner.shards, help=f"Number of gitleaks processes used for the first scan of large repositories. With the native engine, number of processes running the detection of all the scans. Defaults to the number of cores ({Scanner.shards}).")
+    parser.add_argument('--shard-threshold', action="store", dest='shard_threshold', type=int, default=Scanner.shard_threshold, help=f"Minimum number of commits for the first scan of a repository to be sharded. Defaults to {Scanner.shard_threshold}.")
+    parser.add_argument('--rescan-commits', action="store", dest='rescan_commits', type=int, default=Scanner.rescan_commits, help=f"Maximum number of previous commits of a repository scanned again in a run after rules are added to the gitleaks configuration or the allowlist of the repository is loosened. The remaining commits are scanned in the following runs. Defaults to {Scanner.rescan_commits}.")
+    parser.add_argument('--fingerprint-commits', action="store_true", dest='fingerprint_commits', default=False, help="Report the same secret again when it is found in another commit. By default, a secret is only reported the first time it is found in a file of a repository.")
+    parser.add_argument('--metrics-json', action="store", dest='metrics_json', default=None, help="File where a JSON report of the run metrics will be saved.")
+    parser.add_argument('--metrics-prometheus', action="store", dest='metrics_prometheus', default=None, help="File where the run metrics will be saved for the Prometheus textfile collector.")
+    parser.add_argument('--profile', action="store", dest='profile_file', default=None, help="File where cProfile statistics of the run will be saved.")
+    parser.add_argument('--daemon', '-d', action="store_true", dest='daemon', default=False, help="Keep running and scan repositories as they change, sweeping each organization at its configured interval. Send SIGHUP to reload the configuration.")
+    parser.add_argument('--listen', action="store", dest='listen', default=None, help="In daemon mode, address (e.g. 0.0.0.0:8080) where Azure DevOps git.push service hooks are received to scan pushed repositories right away. Requires a hook-password for every organization. Organizations are still swept at their configured interval to catch missed events.")
+    parser.add_argument('--coordinator', action="store_true", dest='coordinator', default=False, help="Publish the repositories to scan to the work queue in the shared directory and report the secrets found by the workers.")
+    parser.add_argument('--worker', action="store_true", dest='worker', default=False, help="Scan the repositories published to the work queue in the shared directory until stopped.")
+    parser.add_argument('--shared', action="store", dest='shared_path', default=None, help="Directory on storage shared by the coordinator and the workers, holding the work queue and the scan results.")
+    parser.add_argument('--worker-name', action="store", dest='worker_name', default=socket.gethostname(), help="Name of this worker. Repositories are assigned to workers by name to reuse their cached clones. Defaults to the host name.")
     parser.add_argument('--lock', '-l', action="store_true", dest='lock', default=False, help="Only allow one instance of the tool to run at the time.")
     parser.add_argument('-v', action="store_true", dest='verbose', default=False, help="Increases output verbosity.")
     parser.add_argument('-q', action="store_true", dest='quiet', default=False, help="Sets log level to error.")
 
+    subparsers = parser.add_subparsers(dest='command', metavar='{report}')
+    report_parser = subparsers.add_parser('report', help="Write the secrets already found, from the cache only, without connecting to Azure DevOps or cloning repositories.")
+    report_parser.add_argument('--repo', '-r', action="append", dest='report_repos', type=parse_selector, default=None, help="Only report the repositories matching organization/project/repository. Each part can be a glob pattern. Can be repeated.")
+    report_parser.add_argument('--project', '-p', action="append", dest='report_projects', type=parse_project_selector, default=None, help="Only report the repositories of the projects matching organization/project. Each part can be a glob pattern. Can be repeated.")
+    report_parser.add_argument('--rule', action="append", dest='rules', default=None, help="Only report the secrets found by the rules matching this description. Can be a glob pattern (e.g. 'AWS*'). Can be repeated.")
+    report_parser.add_argument('--since', action="store", dest='since', type=parse_date, default=None, help="Only report the secrets first committed on or after this date (e.g. 2021-06-01).")
+    report_parser.add_argument('--before', action="store", dest='before', type=parse_date, default=None, help="Only report the secrets first committed before this date.")
+    report_parser.add_argument('--format', '-f', action="store", dest='format', choices=FindingsReport.formats, default="csv", help="Format of the report. Defaults to csv.")
+    report_parser.add_argument('--output', '-o', action="store", dest='report_file', default="-", help="File where the report will be saved. Defaults to the standard output.")
+
     args = parser.parse_args()
+    if (args.coordinator or args.worker) and not args.shared_path:
+        parser.error("--coordinator and --worker require --shared.")
+    selectors = (args.repos or []) + (args.projects or []) or None
+    if selectors and (args.daemon or args.worker):
+        parser.error("--repo and --project cannot be used with --daemon or --worker.")
+    if args.time_budget and (args.daemon or args.worker or args.coordinator):
+        parser.error("--time-budget cannot be used with --daemon, --worker or --coordinator.")
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
-        logging.getLogger("git").setLevel(logging.INFO)
     elif args.quiet:
         logging.getLogger().setLevel(logging.ERROR)
     else:
         logging.getLogger().setLevel(logging.INFO)
 
-    cache_path = Path(args.cache_path)
-    Scanner.results_path = cache_path / "results"
-    GitRepository.repos_path = cache_path / "repos"
-    Scanner.results_path.mkdir(parents=True, exist_ok=True)
-    GitRepository.repos_path.mkdir(parents=True, exist_ok=True)
+    GitRepository.maintenance_interval = args.maintenance_interval
+    ResponseCache.ttl = args.listing_ttl
+    Scanner.shards = max(1, args.shards)
+    Scanner.shard_threshold = args.shard_threshold
+    Scanner.engine = args.engine
+    Scanner.rescan_commits = max(1, args.rescan_commits)
+    ScanStore.fingerprint_commits = args.fingerprint_commits
+
+    if args.command == "report":
+        store = open_store(Path(args.cache_path), Path(args.shared_path) if args.shared_path else None)
+        try:
+            store.migrate_json_results(Path(args.cache_path) / "results")
+            report(store, args.report_file, args.format, (args.report_repos or []) + (args.report_projects or []) or None,
+                   args.rules, args.since, args.before)
+        finally:
+            store.close()
+        return
 
     configuration = load_configuration(args.config_file)
+    if args.listen and any(not org_config.hook_password for org_config in configuration.organizations):
+        parser.error("--listen requires a hook-password for every organization.")
+
+    if args.profile_file:
+        metrics.profiler = Profiler()
+
+    if args.lock:
+        from pid import PidFile
 
     with PidFile() if args.lock else nullcontext():
-        execute(configuration, args.output_all, args.output_file, args.output_slack)
+        shared_path = Path(args.shared_path) if args.shared_path else None
+        with open_cache(Path(args.cache_path), args.repo_cache_size, shared_path):
+            work_queue = SqliteWorkQueue(shared_path / "work-queue.db") if args.coordinator or args.worker else None
+            if Scanner.engine == "native" and Scanner.shards > 1:
+                Scanner.detection_pool = ProcessPoolExecutor(Scanner.shards, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                if args.coordinator:
+                    metrics.profile(execute_coordinator, configuration, args.output_all, args.output_file, args.output_slack, work_queue, selectors)
+                elif args.worker:
+                    metrics.profile(work, configuration, work_queue, args.worker_name, max(1, args.workers))
+                elif args.daemon:
+                    metrics.profile(execute_continuously, args.config_file, args.output_all, args.output_file, args.output_slack, max(1, args.workers), args.listen)
+                else:
+                    metrics.profile(execute, configuration, args.output_all, args.output_file, args.output_slack, max(1, args.workers), selectors, args.time_budget)
+            finally:
+                if work_queue:
+                    work_queue.close()
+                if Scanner.detection_pool:
+                    Scanner.detection_pool.shutdown(cancel_futures=True)
+                write_metrics(args.metrics_json, args.metrics_prometheus, args.profile_file)
 
 
 if __name__ == "__main__":
@@ -1,2 +1,3 @@
 from .config import *
 from .git_repository_information import *
+from .repository_selector import *
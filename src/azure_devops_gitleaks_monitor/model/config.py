@@ -1,5 +1,9 @@
 import copy
-from typing import Dict, List
+import hashlib
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import toml
 
 DEFAULT_KEY = "default"
 
@@ -10,7 +14,16 @@ class GitRepositoryConfiguration:
         self.skip = False
         self.persist = False
         self.slack_webhook = None
-        self.allowlist: Dict[str, List] = {}
+        self.allowlist: Mapping[str, List] = {}
+        self.allowlist_config: Optional[str] = None
+        self.allowlist_hash: Optional[str] = None
+        self._frozen = False
+
+    def __setattr__(self, name, value):
+        # The default configuration of a project is shared by all its repositories which are not configured.
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"The configuration of repository {self.name} cannot be changed once loaded.")
+        super().__setattr__(name, value)
 
     def configure(self, config: Dict):
         self.skip = config.get("skip", False)
@@ -22,6 +35,16 @@ class GitRepositoryConfiguration:
         for allowlist_type, values in config.get("allowlist", {}).items():
             self.allowlist.setdefault(allowlist_type, []).extend(values)
 
+    def freeze(self):
+        self.allowlist = MappingProxyType(dict((allowlist_type, tuple(values)) for allowlist_type, values in self.allowlist.items()))
+
+        allowlist = dict((allowlist_type, list(self.allowlist[allowlist_type]))
+                         for allowlist_type in ("regexes", "paths", "files") if self.allowlist.get(allowlist_type))
+        if allowlist:
+            self.allowlist_config = toml.dumps({"allowlist": allowlist})
+            self.allowlist_hash = hashlib.sha256(self.allowlist_config.encode("utf-8")).hexdigest()
+        self._frozen = True
+
 
 class GitProjectConfiguration:
     def __init__(self, name):
@@ -37,9 +60,17 @@ class GitProjectConfiguration:
 
         for repo_name, repo_config in repo_configs.items():
             if repo_name != DEFAULT_KEY:
-                self.get_repository(repo_name).configure(repo_config)
+                self._get_or_create_repository(repo_name).configure(repo_config)
 
-    def get_repository(self, repository_name):
+    def freeze(self):
+        self._default_repository_configuration.freeze()
+        for repository in self.repositories.values():
+            repository.freeze()
+
+    def get_repository(self, repository_name) -> GitRepositoryConfiguration:
+        return self.repositories.get(repository_name) or self._default_repository_configuration
+
+    def _get_or_create_repository(self, repository_name):
         repository = self.repositories.get(repository_name)
         if not repository:
             repository = copy.deepcopy(self._default_repository_configuration)
@@ -53,10 +84,20 @@ class OrganizationConfiguration:
         self._projects: Dict[str, GitProjectConfiguration] = {}
         self._default_project_configuration = GitProjectConfiguration(DEFAULT_KEY)
         self.name = name
+        self.url = "https://dev.azure.com"
         self.username = ""
         self.password = ""
+        self.max_concurrent_requests = 8
+        self.scan_interval = 3600
+        self.max_concurrent_scans = 0
+        self.hook_password = None
+        self._repositories: Dict[Tuple[str, str], GitRepositoryConfiguration] = {}
 
     def configure(self, config: dict):
+        url = config.get("url")
+        if url:
+            self.url = url
+
         username = config.get("username")
         if username:
             self.username = username
@@ -65,6 +106,22 @@ class OrganizationConfiguration:
         if password:
             self.password = password
 
+        max_concurrent_requests = config.get("max-concurrent-requests")
+        if max_concurrent_requests:
+            self.max_concurrent_requests = max_concurrent_requests
+
+        scan_interval = config.get("scan-interval")
+        if scan_interval:
+            self.scan_interval = scan_interval
+
+        max_concurrent_scans = config.get("max-concurrent-scans")
+        if max_concurrent_scans:
+            self.max_concurrent_scans = max_concurrent_scans
+
+        hook_password = config.get("hook-password")
+        if hook_password:
+            self.hook_password = hook_password
+
         project_configs = config.get("projects", {})
         default_project_config = project_configs.get(DEFAULT_KEY)
         if default_project_config:
@@ -72,9 +129,24 @@ class OrganizationConfiguration:
 
         for project_name, project_config in project_configs.items():
             if project_name != DEFAULT_KEY:
-                self.get_project(project_name).configure(project_config)
+                self._get_or_create_project(project_name).configure(project_config)
+
+    def freeze(self):
+        self._default_project_configuration.freeze()
+        for project in self._projects.values():
+            project.freeze()
+
+        self._repositories = dict(((project.name, repository.name), repository)
+                                  for project in self._projects.values()
+                                  for repository in project.repositories.values())
+
+    def get_project(self, project_name) -> GitProjectConfiguration:
+        return self._projects.get(project_name) or self._default_project_configuration
+
+    def get_repository(self, project_name, repository_name) -> GitRepositoryConfiguration:
+        return self._repositories.get((project_name, repository_name)) or self.get_project(project_name).get_repository(repository_name)
 
-    def get_project(self, project_name):
+    def _get_or_create_project(self, project_name):
         project = self._projects.get(project_name)
         if not project:
             project = copy.deepcopy(self._default_project_configuration)
@@ -98,4 +170,5 @@ class Configuration:
                 organization = copy.deepcopy(default_organization)
                 organization.name = organization_name
                 organization.configure(organization_config)
-                self.organizations.append(organization)
\ No newline at end of file
+                organization.freeze()
+                self.organizations.append(organization)
@@ -0,0 +1,26 @@
+from fnmatch import fnmatchcase
+
+
+class RepositorySelector:
+    def __init__(self, organization, project, repository="*"):
+        self.organization = organization
+        self.project = project
+        self.repository = repository
+
+    @staticmethod
+    def parse(value, with_repository=True):
+        parts = value.split("/")
+        if len(parts) != (3 if with_repository else 2) or not all(parts):
+            raise ValueError(f"'{value}' is not in the organization/project{'/repository' if with_repository else ''} format.")
+        return RepositorySelector(*parts)
+
+    @staticmethod
+    def is_pattern(value):
+        return any(c in value for c in "*?[")
+
+    @staticmethod
+    def matches(pattern, value):
+        return fnmatchcase(value.lower(), pattern.lower())
+
+    def __str__(self):
+        return f"{self.organization}/{self.project}/{self.repository}"
@@ -0,0 +1,144 @@
+import base64
+import hmac
+import json
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit, quote
+
+import dateutil.parser
+import requests
+
+from model import OrganizationConfiguration, GitRepositoryInformation
+from run_metrics import metrics
+
+EMPTY_OBJECT_ID = "0" * 40
+REPOSITORY_ID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+class PushEventReceiver(object):
+    max_body_size = 10 * 1024 * 1024
+
+    def __init__(self, address: str, organizations: List[OrganizationConfiguration],
+                 resolve_repository: Callable[[OrganizationConfiguration, str], Optional[GitRepositoryInformation]],
+                 on_push: Callable[[OrganizationConfiguration, GitRepositoryInformation, datetime, Dict[str, Optional[str]]], None]):
+        missing_passwords = [org_config.name for org_config in organizations if not org_config.hook_password]
+        if missing_passwords:
+            raise ValueError(f"hook-password must be configured to receive push events of {', '.join(missing_passwords)}.")
+
+        host, _, port = address.rpartition(":")
+        self.organizations = organizations
+        self._resolve_repository = resolve_repository
+        self._on_push = on_push
+        self._started = False
+        self._server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), _create_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="push-event-receiver", daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        self._started = True
+        logging.info(f"Listening for push events on {self.address}.")
+
+    def close(self):
+        if self._started:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def get_organization(self, remote_url: str) -> Optional[OrganizationConfiguration]:
+        remote = urlsplit(remote_url)
+        for org_config in self.organizations:
+            url = urlsplit(org_config.url)
+            if remote.hostname == url.hostname and remote.path.startswith(f'{url.path.rstrip("/")}/{quote(org_config.name)}/'):
+                return org_config
+        return None
+
+    def receive(self, event: Dict, authorization: Optional[str]) -> int:
+        if event.get("eventType") != "git.push":
+            metrics.increment("push_events_ignored")
+            return 200
+
+        resource = event["resource"]
+        repository = resource["repository"]
+        org_config = self.get_organization(repository["remoteUrl"])
+        if org_config is None:
+            logging.warning(f"Received a push event for {repository['remoteUrl']} which is not in a configured organization.")
+            metrics.increment("push_events_ignored")
+            return 200
+
+        if not org_config.hook_password or not PushEventReceiver._is_authorized(authorization, org_config.hook_password):
+            return 401
+
+        if not isinstance(repository["id"], str) or not REPOSITORY_ID_PATTERN.fullmatch(repository["id"]):
+            logging.warning(f"Received a push event with an invalid repository id {repository['id']!r}.")
+            return 400
+
+        # Only the id is taken from the event, the repository is described by Azure DevOps.
+        try:
+            repo_info = self._resolve_repository(org_config, repository["id"])
+        except requests.RequestException as e:
+            logging.error(f"Could not fetch the repository {repository['id']} of a push event: {e}")
+            return 503
+        if repo_info is None:
+            logging.warning(f"Received a push event for repository {repository['id']} which was not found in {org_config.name} organization.")
+            metrics.increment("push_events_ignored")
+            return 200
+
+        if org_config.get_repository(repo_info.project, repo_info.name).skip:
+            metrics.increment("push_events_ignored")
+            return 200
+
+        ref_updates = dict((f'origin/{update["name"][len("refs/heads/"):]}', None if update["newObjectId"] == EMPTY_OBJECT_ID else update["newObjectId"])
+                           for update in resource.get("refUpdates", []) if update["name"].startswith("refs/heads/"))
+        date = dateutil.parser.isoparse(resource["date"]) if resource.get("date") else datetime.now(timezone.utc)
+
+        logging.info(f"Received a push event for {repo_info}.")
+        metrics.increment("push_events")
+        self._on_push(org_config, repo_info, date, ref_updates)
+        return 202
+
+    @staticmethod
+    def _is_authorized(authorization: Optional[str], password: str) -> bool:
+        if not authorization or not authorization.startswith("Basic "):
+            return False
+        try:
+            credentials = base64.b64decode(authorization[len("Basic "):]).decode("utf-8")
+        except ValueError:
+            return False
+        return hmac.compare_digest(credentials.partition(":")[2], password)
+
+
+def _create_handler(receiver: PushEventReceiver):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            if length > PushEventReceiver.max_body_size:
+                return self._send(413)
+
+            try:
+                event = json.loads(self.rfile.read(length))
+                status = receiver.receive(event, self.headers.get("Authorization"))
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Received an invalid push event: {e}")
+                status = 400
+            self._send(status)
+
+        def _send(self, status):
+            self.send_response(status)
+            if status == 401:
+                self.send_header("WWW-Authenticate", 'Basic realm="azure-devops-gitleaks-monitor"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler
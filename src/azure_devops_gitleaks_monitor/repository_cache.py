@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from util import rmdir, get_directory_size
+
+
+class RepositoryCache(object):
+    pinned_marker = ".persist"
+    trash_directory = ".trash"
+
+    def __init__(self, path: Path, max_size: Optional[int] = None):
+        self.path = path
+        self.max_size = max_size
+
+        self._trash_path = path / RepositoryCache.trash_directory
+        self._trash_path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._in_use: Set[str] = set()
+        self._sizes: Dict[str, int] = {}
+        self._deleter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="repository-cache-cleanup")
+
+        for entry in self._trash_path.iterdir():
+            self._deleter.submit(rmdir, entry)
+
+        if self.enabled:
+            for entry in self._get_entries():
+                self._sizes[entry.name] = get_directory_size(entry)
+            logging.debug(f"Repository cache uses {sum(self._sizes.values())} bytes out of {max_size}.")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size is not None
+
+    def acquire(self, repo_id: str, pinned: bool) -> Path:
+        path = self._get_path(repo_id)
+        with self._lock:
+            self._in_use.add(repo_id)
+
+        if path.exists():
+            self._set_pinned(path, pinned)
+            os.utime(path)
+        return path
+
+    def release(self, repo_id: str, pinned: bool):
+        path = self._get_path(repo_id)
+        with self._lock:
+            self._in_use.discard(repo_id)
+
+        if not path.exists():
+            return
+
+        if not self.enabled and not pinned:
+            self.discard(repo_id)
+            return
+
+        self._set_pinned(path, pinned)
+        os.utime(path)
+        if self.enabled:
+            size = get_directory_size(path)
+            with self._lock:
+                self._sizes[repo_id] = size
+            self.evict()
+
+    def discard(self, repo_id: str):
+        path = self._get_path(repo_id)
+        if not path.exists():
+            return
+
+        trash = self._trash_path / f"{repo_id}-{uuid.uuid4().hex}"
+        path.rename(trash)
+        with self._lock:
+            self._sizes.pop(repo_id, None)
+        self._deleter.submit(rmdir, trash)
+
+    def evict(self):
+        with self._lock:
+            total_size = sum(self._sizes.values())
+            if total_size <= self.max_size:
+                return
+
+            candidates = []
+            for repo_id in self._sizes:
+                path = self.path / repo_id
+                if repo_id in self._in_use or (path / RepositoryCache.pinned_marker).exists():
+                    continue
+                try:
+                    candidates.append((path.stat().st_mtime, repo_id))
+                except FileNotFoundError:
+                    continue
+
+            evicted = []
+            for _, repo_id in sorted(candidates):
+                if total_size <= self.max_size:
+                    break
+                total_size -= self._sizes[repo_id]
+                evicted.append(repo_id)
+
+        for repo_id in evicted:
+            logging.debug(f"Evicting {repo_id} from the repository cache...")
+            self.discard(repo_id)
+
+        if total_size > self.max_size:
+            logging.warning(f"Repository cache uses {total_size} bytes, which is over its {self.max_size} bytes budget.")
+
+    def close(self):
+        self._deleter.shutdown(wait=True)
+
+    def _get_path(self, repo_id: str) -> Path:
+        path = self.path / repo_id
+        if path.resolve().parent != self.path.resolve():
+            raise ValueError(f"Repository id {repo_id!r} is not a directory of the repository cache.")
+        return path
+
+    def _get_entries(self):
+        return [entry for entry in self.path.iterdir() if entry.is_dir() and entry.name != RepositoryCache.trash_directory]
+
+    @staticmethod
+    def _set_pinned(path: Path, pinned: bool):
+        marker = path / RepositoryCache.pinned_marker
+        if pinned:
+            marker.touch(exist_ok=True)
+        elif marker.exists():
+            marker.unlink()
@@ -0,0 +1,72 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class CachedResponse(object):
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], headers: Dict[str, str], body: Any, fetched: float):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+        self.fetched = fetched
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched < ResponseCache.ttl
+
+
+class ResponseCache(object):
+    ttl = 0
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), timeout=5, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT NOT NULL,
+                params TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT NOT NULL,
+                body TEXT NOT NULL,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (url, params)
+            );
+        """)
+
+    def get(self, url: str, params: Dict[str, Any]) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._connection.execute("SELECT etag, last_modified, headers, body, fetched FROM responses WHERE url = ? AND params = ?",
+                                           (url, ResponseCache._get_params_key(params))).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body, fetched = row
+        return CachedResponse(etag, last_modified, json.loads(headers), json.loads(body), fetched)
+
+    def save(self, url: str, params: Dict[str, Any], etag: Optional[str], last_modified: Optional[str], headers: Dict[str, str], body: Any):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (url, params, etag, last_modified, headers, body, fetched) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, ResponseCache._get_params_key(params), etag, last_modified, json.dumps(headers), json.dumps(body), time.time()))
+
+    def touch(self, url: str, params: Dict[str, Any]):
+        with self._lock:
+            self._connection.execute("UPDATE responses SET fetched = ? WHERE url = ? AND params = ?",
+                                     (time.time(), url, ResponseCache._get_params_key(params)))
+
+    def invalidate(self, url: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _get_params_key(params: Dict[str, Any]) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
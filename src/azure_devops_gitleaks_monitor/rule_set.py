@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import toml
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+ALLOWLIST_TYPES = ("regexes", "files", "paths", "commits")
+
+
+class RuleSet(object):
+    path = Path(__file__).parent / "data/gitleaks-rules.toml"
+    _current: 'RuleSet' = None
+    _lock = threading.Lock()
+
+    def __init__(self, config: Dict[str, Any]):
+        self.title = config.get("title", "")
+        self.rules: Dict[str, Dict[str, Any]] = dict((RuleSet.hash(rule), rule) for rule in config.get("rules", []))
+        self.allowlist: Dict[str, Any] = config.get("allowlist", {})
+        self.descriptions = frozenset(rule.get("description", "") for rule in self.rules.values())
+        self.hash = RuleSet.hash(sorted(self.rules))
+
+    @staticmethod
+    def load() -> 'RuleSet':
+        with RuleSet._lock:
+            if RuleSet._current is None:
+                RuleSet._current = RuleSet(RuleSet.read(RuleSet.path))
+            return RuleSet._current
+
+    @staticmethod
+    def read(path: Path) -> Dict[str, Any]:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+
+    @staticmethod
+    def hash(value: Any) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def get_allowlist(self, repo_allowlist: Dict[str, Iterable[str]]) -> Dict[str, List[str]]:
+        allowlist = {}
+        for allowlist_type in ALLOWLIST_TYPES:
+            values = set(self.allowlist.get(allowlist_type, [])) | set(repo_allowlist.get(allowlist_type, []))
+            if values:
+                allowlist[allowlist_type] = sorted(values)
+        return allowlist
+
+    def get_subset_file(self, rule_hashes: Iterable[str], directory: Path) -> Path:
+        rules = [self.rules[h] for h in sorted(rule_hashes) if h in self.rules]
+        subset_file = directory / f"rules-{RuleSet.hash(sorted(RuleSet.hash(rule) for rule in rules))}.toml"
+        if not subset_file.exists():
+            temp_file = subset_file.with_suffix(f".{threading.get_ident()}.tmp")
+            temp_file.write_text(toml.dumps({"title": self.title, "rules": rules, "allowlist": self.allowlist}))
+            os.replace(temp_file, subset_file)
+        return subset_file
@@ -0,0 +1,129 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class Profiler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Optional[pstats.Stats] = None
+
+    def call(self, function, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter.
+            return function(*args, **kwargs)
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    def dump(self, path: Path):
+        with self._lock:
+            if self._stats is not None:
+                self._stats.dump_stats(str(path))
+
+
+class RunMetrics(object):
+    prometheus_prefix = "azure_devops_gitleaks_monitor"
+
+    def __init__(self):
+        self.profiler: Optional[Profiler] = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._started = time.time()
+            self._phases: Dict[str, Dict[str, float]] = {}
+            self._counters: Dict[str, int] = {}
+            self._repositories: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    @contextmanager
+    def time(self, phase, repository=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started, repository)
+
+    def record(self, phase, duration, repository=None):
+        with self._lock:
+            totals = self._phases.setdefault(phase, {"count": 0, "seconds": 0.0, "max": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += duration
+            totals["max"] = max(totals["max"], duration)
+
+            if repository is not None:
+                phases = self._repositories.setdefault(str(repository), {}).setdefault("phases", {})
+                phases[phase] = phases.get(phase, 0.0) + duration
+
+    def increment(self, counter, value=1, repository=None):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+            if repository is not None:
+                counters = self._repositories.setdefault(str(repository), {}).setdefault("counters", {})
+                counters[counter] = counters.get(counter, 0) + value
+
+    def profile(self, function, *args, **kwargs):
+        if self.profiler is None:
+            return function(*args, **kwargs)
+        return self.profiler.call(function, *args, **kwargs)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started": self._started,
+                "duration": time.time() - self._started,
+                "phases": json.loads(json.dumps(self._phases)),
+                "counters": dict(self._counters),
+                "repositories": json.loads(json.dumps(self._repositories)),
+            }
+
+    def write_json(self, path: Path):
+        RunMetrics._write_atomically(path, json.dumps(self.to_dict(), indent=1))
+
+    def write_prometheus(self, path: Path):
+        report = self.to_dict()
+        prefix = RunMetrics.prometheus_prefix
+
+        lines = [f"# HELP {prefix}_run_duration_seconds Duration of the last run.",
+                 f"# TYPE {prefix}_run_duration_seconds gauge",
+                 f"{prefix}_run_duration_seconds {report['duration']:.3f}",
+                 f"# HELP {prefix}_run_timestamp_seconds Start time of the last run.",
+                 f"# TYPE {prefix}_run_timestamp_seconds gauge",
+                 f"{prefix}_run_timestamp_seconds {report['started']:.0f}",
+                 f"# HELP {prefix}_phase_seconds Time spent in each phase during the last run.",
+                 f"# TYPE {prefix}_phase_seconds gauge"]
+        lines.extend(f'{prefix}_phase_seconds{{phase="{phase}"}} {totals["seconds"]:.3f}' for phase, totals in sorted(report["phases"].items()))
+        lines.extend([f"# HELP {prefix}_phase_count Number of times each phase ran during the last run.",
+                      f"# TYPE {prefix}_phase_count gauge"])
+        lines.extend(f'{prefix}_phase_count{{phase="{phase}"}} {totals["count"]}' for phase, totals in sorted(report["phases"].items()))
+        for counter, value in sorted(report["counters"].items()):
+            lines.extend([f"# TYPE {prefix}_{counter} gauge", f"{prefix}_{counter} {value}"])
+
+        RunMetrics._write_atomically(path, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def _write_atomically(path: Path, content: str):
+        temp_file = Path(f"{path}.tmp")
+        temp_file.write_text(content)
+        os.replace(temp_file, path)
+
+
+metrics = RunMetrics()
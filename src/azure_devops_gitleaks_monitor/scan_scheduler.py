@@ -0,0 +1,84 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple, Any
+
+import dateutil.parser
+
+from model import OrganizationConfiguration, GitRepositoryInformation
+
+
+class ScanScheduler(object):
+    def __init__(self, workers: int):
+        self._workers = workers
+        self._heap: List[Tuple[float, int, OrganizationConfiguration, GitRepositoryInformation, Tuple[Any, ...]]] = []
+        self._sequence = itertools.count()
+        self._scheduled: Set[str] = set()
+        self._started: Set[str] = set()
+        self._rescheduled: Dict[str, Tuple[float, int, OrganizationConfiguration, GitRepositoryInformation, Tuple[Any, ...]]] = {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    @property
+    def running(self) -> int:
+        with self._lock:
+            return sum(self._running.values())
+
+    def schedule(self, priority: float, org_config: OrganizationConfiguration, repo_info: GitRepositoryInformation, *args) -> bool:
+        with self._lock:
+            entry = (priority, next(self._sequence), org_config, repo_info, args)
+            if repo_info.id in self._started:
+                self._rescheduled[repo_info.id] = entry
+                return True
+            if repo_info.id in self._scheduled:
+                return False
+
+            self._scheduled.add(repo_info.id)
+            heapq.heappush(self._heap, entry)
+            return True
+
+    def next(self) -> Optional[Tuple[OrganizationConfiguration, GitRepositoryInformation, Tuple[Any, ...]]]:
+        with self._lock:
+            if sum(self._running.values()) >= self._workers:
+                return None
+
+            deferred = []
+            try:
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    org_config = entry[2]
+                    if org_config.max_concurrent_scans and self._running.get(org_config.name, 0) >= org_config.max_concurrent_scans:
+                        deferred.append(entry)
+                        continue
+
+                    self._running[org_config.name] = self._running.get(org_config.name, 0) + 1
+                    self._started.add(entry[3].id)
+                    return org_config, entry[3], entry[4]
+                return None
+            finally:
+                for entry in deferred:
+                    heapq.heappush(self._heap, entry)
+
+    def done(self, org_config: OrganizationConfiguration, repo_info: GitRepositoryInformation):
+        with self._lock:
+            self._running[org_config.name] -= 1
+            self._started.discard(repo_info.id)
+
+            entry = self._rescheduled.pop(repo_info.id, None)
+            if entry is None:
+                self._scheduled.discard(repo_info.id)
+            else:
+                heapq.heappush(self._heap, entry)
+
+    @staticmethod
+    def get_priority(last_push: Optional[datetime], last_scan_date: Optional[str]) -> float:
+        # Repositories pushed the most recently after their last scan come first, never scanned ones before all others.
+        last_push_timestamp = last_push.timestamp() if last_push else time.time()
+        last_scan_timestamp = dateutil.parser.isoparse(last_scan_date).timestamp() if last_scan_date else 0
+        return last_scan_timestamp - last_push_timestamp
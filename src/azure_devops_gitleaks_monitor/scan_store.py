@@ -0,0 +1,498 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, unquote
+
+import dateutil.parser
+
+SCAN_COLUMNS = ("repo_id", "date", "organization", "project_name", "repo_name", "remote_url", "rules_hash", "allowlist_hash")
+FINDING_COLUMNS = ("repo_id", "fingerprint", "first_commit", "first_date", "last_commit", "last_date", "occurrences")
+
+
+class Finding(object):
+    def __init__(self, fingerprint: str, secret: Dict[str, Any]):
+        self.fingerprint = fingerprint
+        self.secret = secret
+        self.first_commit = self.last_commit = secret.get("commit")
+        self.first_date = self.last_date = Finding._get_date(secret)
+        self.occurrences = 1
+
+    def add(self, secret: Dict[str, Any]):
+        date = Finding._get_date(secret)
+        if date < self.first_date:
+            self.secret = secret
+            self.first_commit = secret.get("commit")
+            self.first_date = date
+        if date > self.last_date:
+            self.last_commit = secret.get("commit")
+            self.last_date = date
+        self.occurrences += 1
+
+    @staticmethod
+    def _get_date(secret: Dict[str, Any]) -> str:
+        try:
+            return dateutil.parser.isoparse(secret["date"]).astimezone(timezone.utc).isoformat()
+        except (KeyError, TypeError, ValueError):
+            return ""
+
+
+class ScanStore(ABC):
+    fingerprint_commits = False
+
+    def fingerprint(self, secret: Dict[str, Any]) -> str:
+        offender = hashlib.sha256(str(secret.get("offender", "")).encode()).hexdigest()
+        parts = [secret.get("rule") or "", secret.get("file") or "", offender]
+        if ScanStore.fingerprint_commits:
+            parts.append(secret.get("commit") or "")
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def collect_findings(self, secrets: Iterable[Dict[str, Any]]) -> List[Finding]:
+        findings: Dict[str, Finding] = {}
+        for secret in secrets:
+            fingerprint = self.fingerprint(secret)
+            if fingerprint in findings:
+                findings[fingerprint].add(secret)
+            else:
+                findings[fingerprint] = Finding(fingerprint, secret)
+        return list(findings.values())
+
+    @abstractmethod
+    def get_scan(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def has_commits(self, repo_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def get_new_commits(self, repo_id: str, commits: Iterable[str]) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_refs(self, repo_id: str) -> Dict[str, str]:
+        pass
+
+    @abstractmethod
+    def has_finding(self, repo_id: str, fingerprint: str) -> bool:
+        pass
+
+    @abstractmethod
+    def get_secrets(self, repo_id: str) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def save_scan(self, scan: Dict[str, Any], new_commits: Iterable[str], findings: Iterable[Finding], refs: Dict[str, str] = None):
+        pass
+
+    @abstractmethod
+    def save_refs(self, repo_id: str, refs: Dict[str, str]):
+        pass
+
+    @abstractmethod
+    def get_findings(self, repo_id: str) -> List[Tuple[str, Dict[str, Any]]]:
+        pass
+
+    @abstractmethod
+    def get_scans(self) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_rules(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def query_findings(self, repo_ids: Optional[Iterable[str]] = None, rules: Optional[Iterable[str]] = None,
+                       since: Optional[str] = None, before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_detection_config(self, config_hash: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def save_detection_config(self, config_hash: str, config: Any):
+        pass
+
+    @abstractmethod
+    def save_detection(self, repo_id: str, rules_hash: str, allowlist_hash: str, removed_findings: Iterable[str] = (), rescan: Optional[Dict[str, Any]] = None):
+        pass
+
+    @abstractmethod
+    def get_rescan(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def save_rescan(self, repo_id: str, rescan: Optional[Dict[str, Any]]):
+        pass
+
+    @abstractmethod
+    def get_indexed_commits(self, detection_key: str, commits: Iterable[str]) -> Set[str]:
+        pass
+
+    @abstractmethod
+    def get_indexed_secrets(self, detection_key: str, commits: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def index_commits(self, detection_key: str, commits: Iterable[str], secrets: Iterable[Dict[str, Any]]):
+        pass
+
+    @abstractmethod
+    def prune_index(self):
+        pass
+
+    @abstractmethod
+    def get_checks(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        pass
+
+    @abstractmethod
+    def save_check(self, repo_id: str, duration: Optional[float] = None):
+        pass
+
+    def close(self):
+        pass
+
+    def migrate_json_results(self, results_path: Path):
+        for scan_file in sorted(results_path.glob("*.json")):
+            logging.info(f"Migrating {scan_file} to the scan store...")
+            with scan_file.open("r") as f:
+                scan = json.load(f)
+
+            commits = scan.pop("commits", None) or []
+            secrets = scan.pop("secrets", None) or []
+            if not scan.get("organization") and scan.get("remote_url"):
+                # Remote URLs end with organization/project/_git/repository, the organization being the collection on Azure DevOps Server.
+                scan["organization"] = ScanStore._get_organization(scan["remote_url"])
+            self.save_scan(scan, commits, self.collect_findings(secrets))
+            scan_file.rename(scan_file.with_suffix(".json.migrated"))
+
+    @staticmethod
+    def _get_organization(remote_url: str) -> Optional[str]:
+        parts = urlsplit(remote_url).path.strip("/").split("/")
+        if len(parts) >= 4 and parts[-2] == "_git":
+            return unquote(parts[-4])
+        return None
+
+
+class SqliteScanStore(ScanStore):
+    batch_size = 500
+
+    def __init__(self, path: Path, shared: bool = False):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), timeout=60 if shared else 5, check_same_thread=False, isolation_level=None)
+        if shared:
+            self._connection.execute("PRAGMA journal_mode=DELETE")
+        else:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS scans (
+                repo_id TEXT PRIMARY KEY,
+                date TEXT NOT NULL,
+                organization TEXT,
+                project_name TEXT,
+                repo_name TEXT,
+                remote_url TEXT,
+                rules_hash TEXT,
+                allowlist_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS scans_names ON scans (organization, project_name, repo_name);
+            CREATE TABLE IF NOT EXISTS commits (
+                repo_id TEXT NOT NULL,
+                sha BLOB NOT NULL,
+                PRIMARY KEY (repo_id, sha)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS refs (
+                repo_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                sha BLOB NOT NULL,
+                PRIMARY KEY (repo_id, name)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS findings (
+                repo_id TEXT NOT NULL,
+                fingerprint BLOB NOT NULL,
+                first_commit TEXT,
+                first_date TEXT NOT NULL,
+                last_commit TEXT,
+                last_date TEXT NOT NULL,
+                occurrences INTEGER NOT NULL,
+                rule TEXT,
+                data TEXT NOT NULL,
+                UNIQUE (repo_id, fingerprint)
+            );
+            CREATE INDEX IF NOT EXISTS findings_rule ON findings (rule);
+            CREATE INDEX IF NOT EXISTS findings_first_date ON findings (first_date);
+            CREATE TABLE IF NOT EXISTS indexed_commits (
+                sha BLOB NOT NULL,
+                detection_key TEXT NOT NULL,
+                PRIMARY KEY (sha, detection_key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS indexed_secrets (
+                sha BLOB NOT NULL,
+                detection_key TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS indexed_secrets_sha ON indexed_secrets (sha, detection_key);
+            CREATE TABLE IF NOT EXISTS detection_configs (
+                hash TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rescans (
+                repo_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS checks (
+                repo_id TEXT PRIMARY KEY,
+                date TEXT NOT NULL,
+                duration REAL
+            );
+        """)
+
+    def get_scan(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(SCAN_COLUMNS)} FROM scans WHERE repo_id = ?", (repo_id,)).fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(SCAN_COLUMNS, row))
+
+    def has_commits(self, repo_id: str) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM commits WHERE repo_id = ? LIMIT 1", (repo_id,)).fetchone() is not None
+
+    def get_new_commits(self, repo_id: str, commits: Iterable[str]) -> List[str]:
+        commits = [c for c in commits if c]
+        known = set()
+        with self._lock:
+            for i in range(0, len(commits), SqliteScanStore.batch_size):
+                batch = [bytes.fromhex(c) for c in commits[i:i + SqliteScanStore.batch_size]]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT sha FROM commits WHERE repo_id = ? AND sha IN ({placeholders})", [repo_id, *batch])
+                known.update(row[0].hex() for row in rows)
+        return [c for c in commits if c not in known]
+
+    def get_refs(self, repo_id: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT name, sha FROM refs WHERE repo_id = ?", (repo_id,)).fetchall()
+        return dict((name, sha.hex()) for name, sha in rows)
+
+    def has_finding(self, repo_id: str, fingerprint: str) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM findings WHERE repo_id = ? AND fingerprint = ?", (repo_id, bytes.fromhex(fingerprint))).fetchone() is not None
+
+    def get_secrets(self, repo_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT data FROM findings WHERE repo_id = ? ORDER BY rowid", (repo_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_scan(self, scan: Dict[str, Any], new_commits: Iterable[str], findings: Iterable[Finding], refs: Dict[str, str] = None):
+        repo_id = scan["repo_id"]
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO scans ({', '.join(SCAN_COLUMNS)}) VALUES ({', '.join('?' * len(SCAN_COLUMNS))})",
+                [repo_id, *(scan.get(column) for column in SCAN_COLUMNS[1:])])
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO commits (repo_id, sha) VALUES (?, ?)",
+                ((repo_id, bytes.fromhex(c)) for c in new_commits if c))
+            self._save_findings(repo_id, findings)
+            if refs is not None:
+                self._replace_refs(repo_id, refs)
+
+    def save_refs(self, repo_id: str, refs: Dict[str, str]):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._replace_refs(repo_id, refs)
+
+    def get_findings(self, repo_id: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT fingerprint, data FROM findings WHERE repo_id = ? ORDER BY rowid", (repo_id,)).fetchall()
+        return [(fingerprint.hex(), json.loads(data)) for fingerprint, data in rows]
+
+    def get_scans(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {', '.join(SCAN_COLUMNS)} FROM scans").fetchall()
+        return [dict(zip(SCAN_COLUMNS, row)) for row in rows]
+
+    def get_rules(self) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT DISTINCT rule FROM findings WHERE rule IS NOT NULL").fetchall()
+        return [row[0] for row in rows]
+
+    def query_findings(self, repo_ids: Optional[Iterable[str]] = None, rules: Optional[Iterable[str]] = None,
+                       since: Optional[str] = None, before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        conditions = []
+        parameters: List[Any] = []
+        if rules is not None:
+            rules = list(rules)
+            conditions.append(f"rule IN ({','.join('?' * len(rules))})")
+            parameters.extend(rules)
+        if since:
+            conditions.append("first_date >= ?")
+            parameters.append(since)
+        if before:
+            conditions.append("first_date < ?")
+            parameters.append(before)
+
+        if repo_ids is None:
+            batches = [None]
+        else:
+            repo_ids = sorted(repo_ids)
+            batches = [repo_ids[i:i + SqliteScanStore.batch_size] for i in range(0, len(repo_ids), SqliteScanStore.batch_size)]
+
+        for batch in batches:
+            batch_conditions = list(conditions)
+            batch_parameters = list(parameters)
+            if batch is not None:
+                batch_conditions.append(f"repo_id IN ({','.join('?' * len(batch))})")
+                batch_parameters.extend(batch)
+            where = f"WHERE {' AND '.join(batch_conditions)}" if batch_conditions else ""
+
+            with self._lock:
+                cursor = self._connection.execute(f"SELECT {', '.join(FINDING_COLUMNS)}, data FROM findings {where} ORDER BY repo_id, first_date",
+                                                  batch_parameters)
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(SqliteScanStore.batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    finding = dict(zip(FINDING_COLUMNS, row))
+                    finding["fingerprint"] = finding["fingerprint"].hex()
+                    finding["secret"] = json.loads(row[-1])
+                    yield finding
+
+    def get_detection_config(self, config_hash: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM detection_configs WHERE hash = ?", (config_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_detection_config(self, config_hash: str, config: Any):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("INSERT OR IGNORE INTO detection_configs (hash, data) VALUES (?, ?)",
+                                     (config_hash, json.dumps(config, separators=(",", ":"))))
+
+    def save_detection(self, repo_id: str, rules_hash: str, allowlist_hash: str, removed_findings: Iterable[str] = (), rescan: Optional[Dict[str, Any]] = None):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("UPDATE scans SET rules_hash = ?, allowlist_hash = ? WHERE repo_id = ?", (rules_hash, allowlist_hash, repo_id))
+            self._connection.executemany("DELETE FROM findings WHERE repo_id = ? AND fingerprint = ?",
+                                         ((repo_id, bytes.fromhex(f)) for f in removed_findings))
+            self._save_rescan(repo_id, rescan)
+
+    def get_rescan(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM rescans WHERE repo_id = ?", (repo_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_rescan(self, repo_id: str, rescan: Optional[Dict[str, Any]]):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._save_rescan(repo_id, rescan)
+
+    def get_indexed_commits(self, detection_key: str, commits: Iterable[str]) -> Set[str]:
+        with self._lock:
+            return self._get_indexed_commits(detection_key, [c for c in commits if c])
+
+    def get_indexed_secrets(self, detection_key: str, commits: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        commits = list(commits)
+        for i in range(0, len(commits), SqliteScanStore.batch_size):
+            batch = [bytes.fromhex(c) for c in commits[i:i + SqliteScanStore.batch_size]]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT data FROM indexed_secrets WHERE detection_key = ? AND sha IN ({placeholders})", [detection_key, *batch]).fetchall()
+            for row in rows:
+                yield json.loads(row[0])
+
+    def index_commits(self, detection_key: str, commits: Iterable[str], secrets: Iterable[Dict[str, Any]]):
+        commits = [c for c in commits if c]
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            # Another repository sharing these commits may have indexed them since they were looked up.
+            known = self._get_indexed_commits(detection_key, commits)
+
+            self._connection.executemany(
+                "INSERT INTO indexed_commits (sha, detection_key) VALUES (?, ?)",
+                ((bytes.fromhex(c), detection_key) for c in set(commits) - known))
+            self._connection.executemany(
+                "INSERT INTO indexed_secrets (sha, detection_key, data) VALUES (?, ?, ?)",
+                ((bytes.fromhex(s["commit"]), detection_key, json.dumps(s, separators=(",", ":")))
+                 for s in secrets if s.get("commit") and s["commit"] not in known))
+
+    def prune_index(self):
+        # Only the keys of the current rules and allowlists of the stored scans can be looked up again.
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            keys = "SELECT DISTINCT rules_hash || ':' || allowlist_hash FROM scans WHERE rules_hash IS NOT NULL AND allowlist_hash IS NOT NULL"
+            commits = self._connection.execute(f"DELETE FROM indexed_commits WHERE detection_key NOT IN ({keys})").rowcount
+            secrets = self._connection.execute(f"DELETE FROM indexed_secrets WHERE detection_key NOT IN ({keys})").rowcount
+        if commits or secrets:
+            logging.info(f"Removed {commits} commits and {secrets} secrets indexed with previous rules or allowlists.")
+
+    def get_checks(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT repo_id, date, duration FROM checks").fetchall()
+        return dict((repo_id, (date, duration)) for repo_id, date, duration in rows)
+
+    def save_check(self, repo_id: str, duration: Optional[float] = None):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("""
+                INSERT INTO checks (repo_id, date, duration) VALUES (?, ?, ?)
+                ON CONFLICT (repo_id) DO UPDATE SET
+                    date = excluded.date,
+                    duration = CASE WHEN excluded.duration IS NULL THEN duration
+                                    WHEN duration IS NULL THEN excluded.duration
+                                    ELSE (duration + excluded.duration) / 2 END
+            """, (repo_id, datetime.now(timezone.utc).isoformat(), duration))
+
+    def _save_findings(self, repo_id: str, findings: Iterable[Finding]):
+        self._connection.executemany("""
+            INSERT INTO findings (repo_id, fingerprint, first_commit, first_date, last_commit, last_date, occurrences, rule, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (repo_id, fingerprint) DO UPDATE SET
+                first_commit = CASE WHEN excluded.first_date < first_date THEN excluded.first_commit ELSE first_commit END,
+                data = CASE WHEN excluded.first_date < first_date THEN excluded.data ELSE data END,
+                first_date = MIN(first_date, excluded.first_date),
+                last_commit = CASE WHEN excluded.last_date > last_date THEN excluded.last_commit ELSE last_commit END,
+                last_date = MAX(last_date, excluded.last_date),
+                occurrences = occurrences + excluded.occurrences
+        """, ((repo_id, bytes.fromhex(f.fingerprint), f.first_commit, f.first_date, f.last_commit, f.last_date, f.occurrences,
+               f.secret.get("rule"), json.dumps(f.secret, separators=(",", ":"))) for f in findings))
+
+    def _save_rescan(self, repo_id: str, rescan: Optional[Dict[str, Any]]):
+        if rescan is None:
+            self._connection.execute("DELETE FROM rescans WHERE repo_id = ?", (repo_id,))
+        else:
+            self._connection.execute("INSERT OR REPLACE INTO rescans (repo_id, data) VALUES (?, ?)",
+                                     (repo_id, json.dumps(rescan, separators=(",", ":"))))
+
+    def _get_indexed_commits(self, detection_key: str, commits: List[str]) -> Set[str]:
+        known = set()
+        for i in range(0, len(commits), SqliteScanStore.batch_size):
+            batch = [bytes.fromhex(c) for c in commits[i:i + SqliteScanStore.batch_size]]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT sha FROM indexed_commits WHERE detection_key = ? AND sha IN ({placeholders})", [detection_key, *batch])
+            known.update(row[0].hex() for row in rows)
+        return known
+
+    def _replace_refs(self, repo_id: str, refs: Dict[str, str]):
+        self._connection.execute("DELETE FROM refs WHERE repo_id = ?", (repo_id,))
+        self._connection.executemany(
+            "INSERT INTO refs (repo_id, name, sha) VALUES (?, ?, ?)",
+            ((repo_id, name, bytes.fromhex(sha)) for name, sha in refs.items()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
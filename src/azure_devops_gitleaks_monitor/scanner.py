@@ -1,120 +1,333 @@
-import json
+import itertools
 import logging
 import os
+import queue
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Executor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Any, Iterable
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 
 import dateutil.parser
-import toml
 
+from detection_engine import DetectionEngine, Allowlist
 from git_repository import GitRepository
 from gitleaks_executor import GitleaksExecutor
 from model import OrganizationConfiguration, GitRepositoryConfiguration, GitRepositoryInformation
+from rule_set import RuleSet
+from run_metrics import metrics
+from scan_store import ScanStore, Finding
 
 
 class Scanner(object):
-    results_path: Path = None
+    store: ScanStore = None
+    allowlists_path: Path = None
+    shards: int = os.cpu_count() or 1
+    shard_threshold: int = 10000
+    engine: str = "gitleaks"
+    detection_pool: Optional[Executor] = None
+    rescan_commits: int = 10000
 
     def __init__(self, org_config: OrganizationConfiguration, repo_config: GitRepositoryConfiguration, repo_info: GitRepositoryInformation):
         self._org_config = org_config
         self._repo_config = repo_config
         self._repo_info = repo_info
-        self._scan_file = Scanner.results_path / f"{repo_info.id}.json"
 
-        self._previous_scan = self._load_previous_scan() or {}
+        self._rules = RuleSet.load()
+        self._allowlist = self._rules.get_allowlist(repo_config.allowlist)
+        self._allowlist_hash = RuleSet.hash(self._allowlist)
+
+        self._previous_scan = Scanner.store.get_scan(repo_info.id) or {}
         self._scan = {
             "date": datetime.utcnow().replace(tzinfo=timezone.utc).isoformat(),
             "repo_id": repo_info.id,
+            "organization": repo_info.organization,
             "project_name": repo_info.project,
             "repo_name": repo_info.name,
-            "remote_url": repo_info.remote_url
+            "remote_url": repo_info.remote_url,
+            "rules_hash": self._rules.hash,
+            "allowlist_hash": self._allowlist_hash
         }
+        self._new_commits = []
+        self._scanned_commits = []
+        self._detected_secrets = []
+        self._findings: Dict[str, Finding] = {}
+        self._refs = None
+        self._rescanned = False
+        self._rescan = None
+
+    @staticmethod
+    def is_outdated(repo_info: GitRepositoryInformation, repo_config: GitRepositoryConfiguration) -> bool:
+        scan = Scanner.store.get_scan(repo_info.id)
+        if scan is None:
+            return False
 
-    def should_scan(self, last_push: datetime):
+        rules = RuleSet.load()
+        return (scan.get("rules_hash") != rules.hash or scan.get("allowlist_hash") != RuleSet.hash(rules.get_allowlist(repo_config.allowlist))
+                or Scanner.store.get_rescan(repo_info.id) is not None)
+
+    def should_scan(self, last_push: Optional[datetime], remote_branches: Optional[Dict[str, str]] = None):
         last_scan_date = self._previous_scan.get("date")
         if not last_scan_date:
             return True
 
-        return last_push > dateutil.parser.isoparse(last_scan_date)
+        if self._update_detection():
+            return True
+
+        previous_branches = Scanner.store.get_refs(self._repo_info.id)
+        if remote_branches is not None and previous_branches:
+            changed_tips = [sha for name, sha in remote_branches.items() if previous_branches.get(name) != sha]
+            if changed_tips and Scanner.store.get_new_commits(self._repo_info.id, changed_tips):
+                return True
 
-    def scan(self) -> Iterable[Dict[str, Any]]:
+            if remote_branches != previous_branches:
+                logging.debug(f"Branches of {self._repo_info} were moved to known commits or deleted.")
+                Scanner.store.save_refs(self._repo_info.id, remote_branches)
+            return False
+
+        return last_push is None or last_push > dateutil.parser.isoparse(last_scan_date)
+
+    def scan(self) -> Iterator[Dict[str, Any]]:
         with GitRepository(self._org_config, self._repo_config, self._repo_info) as repo:
             repo.update()
 
-            commits = repo.get_commits()
-            self._scan["secrets"] = self._previous_scan.get("secrets", [])[:]
-            self._scan["commits"] = commits
+            self._refs = repo.get_branches()
+
+            first_scan = not Scanner.store.has_commits(self._repo_info.id)
+            if first_scan:
+                self._new_commits = repo.get_commits()
+            else:
+                previous_tips = Scanner.store.get_refs(self._repo_info.id).values()
+                commits = repo.get_commits(previous_tips)
+                self._new_commits = Scanner.store.get_new_commits(self._repo_info.id, commits)
 
-            old_commits = self._previous_scan.get("commits")
+            # Commits shared with forks or imported repositories are only scanned once with the same allowlist.
+            inherited_commits = Scanner.store.get_indexed_commits(self._get_detection_key(), self._new_commits)
+            self._scanned_commits = [c for c in self._new_commits if c not in inherited_commits]
+            if inherited_commits:
+                logging.info(f"{len(inherited_commits)} commits of {self._repo_info} were already scanned in another repository.")
 
-            if old_commits:
-                commits_to_scan = list(set(commits) - set(old_commits))
-                new_secrets = self._find_secrets(repo, commits_to_scan)
+            if first_scan and Scanner.shards > 1 and len(self._scanned_commits) >= Scanner.shard_threshold:
+                detected_secrets = self._find_secrets_sharded(repo, self._scanned_commits)
+            elif first_scan and not inherited_commits:
+                detected_secrets = self._find_secrets(repo)
             else:
-                new_secrets = self._find_secrets(repo)
+                detected_secrets = self._find_secrets(repo, self._scanned_commits)
+
+            metrics.increment("commits_scanned", len(self._scanned_commits), self._repo_info)
+            metrics.increment("commits_inherited", len(inherited_commits), self._repo_info)
+            secrets = itertools.chain(self._get_inherited_secrets(repo, inherited_commits), self._record(detected_secrets))
 
-            self._scan["secrets"].extend(new_secrets)
-            return new_secrets
+            rescan = Scanner.store.get_rescan(self._repo_info.id)
+            if rescan:
+                secrets = itertools.chain(secrets, self._run_rescan(repo, rescan))
+            for secret in secrets:
+                metrics.increment("findings", 1, self._repo_info)
+                if self._ingest(secret):
+                    metrics.increment("new_findings", 1, self._repo_info)
+                    yield secret
 
     def get_all_secrets(self) -> Iterable[Dict[str, Any]]:
-        return self._scan.get("secrets") or self._previous_scan.get("secrets") or []
+        return Scanner.store.get_secrets(self._repo_info.id)
 
     def save(self):
-        j = json.dumps(self._scan, indent=1)
-        with self._scan_file.open("w") as f:
-            f.write(j)
+        with metrics.time("save", self._repo_info):
+            Scanner.store.save_detection_config(self._rules.hash, sorted(self._rules.rules))
+            Scanner.store.save_detection_config(self._allowlist_hash, self._allowlist)
+            Scanner.store.save_scan(self._scan, self._new_commits, self._findings.values(), self._refs)
+            Scanner.store.index_commits(self._get_detection_key(), self._scanned_commits, self._detected_secrets)
+            if self._rescanned:
+                Scanner.store.save_rescan(self._repo_info.id, self._rescan)
 
-    def _find_secrets(self, repo: GitRepository, commits_to_scan=None) -> Iterable[Dict[str, Any]]:
-        commits_file = Scanner._create_commits_file(commits_to_scan)
-        config_file = self._create_config_file()
+    def _get_detection_key(self) -> str:
+        return f"{self._rules.hash}:{self._allowlist_hash}"
 
-        try:
-            if commits_to_scan is None:
-                logging.info(f"Scanning whole repository for {self._repo_info}...")
-            elif len(commits_to_scan) == 0:
-                logging.info(f"No new commits for {self._repo_info}. Skipping ...")
-                return []
-            else:
-                logging.info(f"Scanning {len(commits_to_scan)} new commits for {self._repo_info}...")
+    def _update_detection(self) -> bool:
+        # Brings the previous scan up to date with the current rules and allowlist, then tells whether history must be scanned again.
+        rescan = Scanner.store.get_rescan(self._repo_info.id)
+        rules_hash = self._previous_scan.get("rules_hash")
+        allowlist_hash = self._previous_scan.get("allowlist_hash")
+        if rules_hash == self._rules.hash and allowlist_hash == self._allowlist_hash:
+            return rescan is not None
 
-            return GitleaksExecutor(repo.path, commits_file, config_file).execute()
-        finally:
-            logging.debug(f"{self._repo_info} scanned.")
-            if commits_file:
-                os.remove(commits_file)
-            if config_file:
-                os.remove(config_file)
+        Scanner.store.save_detection_config(self._rules.hash, sorted(self._rules.rules))
+        Scanner.store.save_detection_config(self._allowlist_hash, self._allowlist)
+        if rules_hash is None:
+            logging.debug(f"Stamped the scan of {self._repo_info} with the current rules and allowlist.")
+            Scanner.store.save_detection(self._repo_info.id, self._rules.hash, self._allowlist_hash, rescan=rescan)
+            return rescan is not None
 
-    def _load_previous_scan(self):
-        if not self._scan_file.exists():
-            return None
+        rescan_rules = set(rescan["rules"]) & self._rules.rules.keys() if rescan else set()
+        previous_rules = Scanner.store.get_detection_config(rules_hash)
+        rescan_rules |= self._rules.rules.keys() - set(previous_rules or [])
+
+        previous_allowlist = Scanner.store.get_detection_config(allowlist_hash) or {}
+        if any(not set(values) <= set(self._allowlist.get(allowlist_type, [])) for allowlist_type, values in previous_allowlist.items()):
+            # Secrets allowed until now can only be found by scanning the history again with all the rules.
+            rescan_rules = set(self._rules.rules)
+
+        removed_findings = self._get_removed_findings()
+        if removed_findings:
+            logging.info(f"Removed {len(removed_findings)} secrets of {self._repo_info} which are now allowed or whose rules were removed.")
+            metrics.increment("findings_removed", len(removed_findings), self._repo_info)
+
+        if not rescan_rules:
+            rescan = None
+        elif rescan and rescan_rules <= set(rescan["rules"]):
+            rescan = dict(rescan, rules=sorted(rescan_rules))
+        else:
+            logging.info(f"Scheduled a scan of the history of {self._repo_info} with {len(rescan_rules)} new rules.")
+            rescan = {"rules": sorted(rescan_rules), "tips": sorted(set(Scanner.store.get_refs(self._repo_info.id).values())), "position": 0}
+
+        Scanner.store.save_detection(self._repo_info.id, self._rules.hash, self._allowlist_hash, removed_findings, rescan)
+        # The commits indexed with the previous key are not looked up again once no scan uses it.
+        Scanner.store.prune_index()
+        return rescan is not None
+
+    def _get_removed_findings(self) -> List[str]:
+        allowlist = Allowlist(self._allowlist)
+        removed_findings = []
+        for fingerprint, secret in Scanner.store.get_findings(self._repo_info.id):
+            path = secret.get("file") or ""
+            line = secret.get("line") or ""
+            if (secret.get("rule") not in self._rules.descriptions or secret.get("commit") in allowlist.commits
+                    or allowlist.allows_file(path, os.path.basename(path)) or (line and allowlist.allows_line(line))):
+                removed_findings.append(fingerprint)
+        return removed_findings
 
-        with self._scan_file.open("r") as f:
-            return json.load(f)
+    def _run_rescan(self, repo: GitRepository, rescan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if not rescan["tips"]:
+            # Scans migrated from the JSON results have no stored refs, the history is taken from the fetched branches instead.
+            rescan = dict(rescan, tips=sorted(set(self._refs.values())))
+        commits = repo.get_history(rescan["tips"])
+        batch = commits[rescan["position"]:rescan["position"] + Scanner.rescan_commits]
+        if batch:
+            logging.info(f"Scanning {len(batch)} more of the {len(commits)} previous commits of {self._repo_info} with {len(rescan['rules'])} new rules...")
+            yield from self._run_gitleaks(repo, batch, self._rules.get_subset_file(rescan["rules"], Scanner.allowlists_path))
 
-    def _create_config_file(self):
-        allowlist = {}
+        metrics.increment("commits_rescanned", len(batch), self._repo_info)
+        position = rescan["position"] + len(batch)
+        self._rescan = dict(rescan, position=position) if position < len(commits) else None
+        self._rescanned = True
 
-        regexes = self._repo_config.allowlist.get("regexes")
-        if regexes:
-            allowlist["regexes"] = regexes
+    def _get_inherited_secrets(self, repo: GitRepository, commits: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        for secret in Scanner.store.get_indexed_secrets(self._get_detection_key(), commits):
+            secret["repo"] = repo.path.name
+            yield secret
 
-        paths = self._repo_config.allowlist.get("paths")
-        if paths:
-            allowlist["paths"] = paths
+    def _record(self, secrets: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for secret in secrets:
+            self._detected_secrets.append(secret)
+            yield secret
 
-        files = self._repo_config.allowlist.get("files")
-        if files:
-            allowlist["files"] = files
+    def _ingest(self, secret: Dict[str, Any]) -> bool:
+        fingerprint = Scanner.store.fingerprint(secret)
+        finding = self._findings.get(fingerprint)
+        if finding is not None:
+            finding.add(secret)
+            return False
+
+        self._findings[fingerprint] = Finding(fingerprint, secret)
+        return not Scanner.store.has_finding(self._repo_info.id, fingerprint)
+
+    def _find_secrets(self, repo: GitRepository, commits_to_scan=None) -> Iterator[Dict[str, Any]]:
+        if commits_to_scan is None:
+            logging.info(f"Scanning whole repository for {self._repo_info}...")
+        elif len(commits_to_scan) == 0:
+            logging.info(f"No new commits for {self._repo_info}. Skipping ...")
+            return
+        else:
+            logging.info(f"Scanning {len(commits_to_scan)} new commits for {self._repo_info}...")
+
+        yield from self._run_gitleaks(repo, commits_to_scan)
+        logging.debug(f"{self._repo_info} scanned.")
+
+    def _find_secrets_sharded(self, repo: GitRepository, commits) -> Iterator[Dict[str, Any]]:
+        shard_size = -(-len(commits) // Scanner.shards)
+        shards = [commits[i:i + shard_size] for i in range(0, len(commits), shard_size)]
+        logging.info(f"Scanning whole repository for {self._repo_info} in {len(shards)} shards of {shard_size} commits...")
+
+        results = queue.Queue()
+        stopped = threading.Event()
+
+        def scan_shard(shard):
+            secrets = self._run_gitleaks(repo, shard)
+            try:
+                for secret in secrets:
+                    if stopped.is_set():
+                        break
+                    results.put(secret)
+            except Exception as e:
+                results.put(e)
+            finally:
+                secrets.close()
+                results.put(None)
+
+        seen = set()
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            try:
+                for shard in shards:
+                    executor.submit(scan_shard, shard)
+
+                remaining = len(shards)
+                while remaining > 0:
+                    item = results.get()
+                    if item is None:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        errors.append(item)
+                        stopped.set()
+                    else:
+                        key = (item.get("commit"), item.get("file"), item.get("lineNumber"), item.get("rule"), item.get("offender"))
+                        if key not in seen:
+                            seen.add(key)
+                            yield item
+            finally:
+                stopped.set()
+
+        if errors:
+            raise errors[0]
+        logging.debug(f"{self._repo_info} scanned.")
+
+    def _run_gitleaks(self, repo: GitRepository, commits_to_scan=None, rules_file: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+        if Scanner.engine == "native":
+            yield from self._run_native(repo, commits_to_scan, rules_file)
+            return
+
+        commits_file = Scanner._create_commits_file(commits_to_scan)
+        started = time.perf_counter()
+
+        try:
+            yield from GitleaksExecutor(repo.path, commits_file, self._get_config_file(), rules_file).execute()
+        finally:
+            metrics.record("gitleaks", time.perf_counter() - started, self._repo_info)
+            if commits_file:
+                os.remove(commits_file)
+
+    def _run_native(self, repo: GitRepository, commits_to_scan=None, rules_file: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+        engine = DetectionEngine(repo.path, commits_to_scan, self._get_config_file(), rules_file)
+        started = time.perf_counter()
+
+        try:
+            if Scanner.detection_pool:
+                yield from Scanner.detection_pool.submit(engine.detect).result()
+            else:
+                yield from engine.execute()
+        finally:
+            metrics.record("detection", time.perf_counter() - started, self._repo_info)
 
-        if len(allowlist) == 0:
+    def _get_config_file(self) -> Optional[Path]:
+        if not self._repo_config.allowlist_config:
             return None
 
-        config_file = tempfile.mktemp()
-        with open(config_file, "w") as f:
-            toml.dump({"allowlist": allowlist}, f)
+        config_file = Scanner.allowlists_path / f"{self._repo_config.allowlist_hash}.toml"
+        if not config_file.exists():
+            temp_file = config_file.with_suffix(f".{threading.get_ident()}.tmp")
+            temp_file.write_text(self._repo_config.allowlist_config)
+            os.replace(temp_file, config_file)
 
         return config_file
 
@@ -0,0 +1,130 @@
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Set
+
+import requests
+
+from run_metrics import metrics
+from throttling_governor import ThrottlingGovernor
+
+
+class SlackDeliveryQueue(object):
+    outbox_path: Path = None
+    max_attempts = 5
+    initial_backoff = 1.0
+    max_backoff = 60.0
+    timeout = 30
+    unavailable_delay = 300.0
+
+    def __init__(self):
+        self._failed_path = SlackDeliveryQueue.outbox_path / "failed"
+        self._failed_path.mkdir(parents=True, exist_ok=True)
+        self._queue = queue.Queue()
+        self._queued: Set[Path] = set()
+        self._queued_lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._unavailable_webhooks: Dict[str, float] = {}
+
+        pending = self.resend_pending()
+        if pending:
+            logging.info(f"Sending {pending} Slack messages left from previous runs...")
+
+        self._thread = threading.Thread(target=self._run, name="slack-delivery", daemon=True)
+        self._thread.start()
+
+    def send(self, webhook: str, blocks: List[Dict[str, Any]]):
+        message_file = SlackDeliveryQueue.outbox_path / f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+        message_file.write_text(json.dumps({"webhook": webhook, "text": "fallback", "blocks": blocks}))
+        self._enqueue(message_file)
+
+    def resend_pending(self) -> int:
+        # Messages left in the outbox by previous runs, or by unavailable webhooks when running as a daemon.
+        return sum(self._enqueue(message_file) for message_file in sorted(SlackDeliveryQueue.outbox_path.glob("*.json")))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        for session in self._sessions.values():
+            session.close()
+
+    def _enqueue(self, message_file: Path) -> bool:
+        with self._queued_lock:
+            if message_file in self._queued:
+                return False
+            self._queued.add(message_file)
+        self._queue.put(message_file)
+        return True
+
+    def _run(self):
+        while True:
+            message_file = self._queue.get()
+            if message_file is None:
+                return
+
+            try:
+                self._process(message_file)
+            except Exception as e:
+                logging.exception(f"Could not send Slack message {message_file}, it is kept in the outbox: {e}")
+            finally:
+                with self._queued_lock:
+                    self._queued.discard(message_file)
+
+    def _process(self, message_file: Path):
+        try:
+            message = json.loads(message_file.read_text())
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read Slack message {message_file}: {e}")
+            return
+
+        webhook = message.pop("webhook")
+        if self._unavailable_webhooks.get(webhook, 0) > time.monotonic():
+            return
+
+        with metrics.time("slack"):
+            delivered = self._deliver(webhook, message, message_file)
+
+        if delivered:
+            message_file.unlink()
+            metrics.increment("slack_messages_sent")
+        elif message_file.exists():
+            logging.error(f"Slack webhook is unavailable. Its messages will be sent again by the next run, or by the next sweep after "
+                          f"{SlackDeliveryQueue.unavailable_delay:.0f}s when running as a daemon.")
+            self._unavailable_webhooks[webhook] = time.monotonic() + SlackDeliveryQueue.unavailable_delay
+            metrics.increment("slack_messages_deferred")
+
+    def _deliver(self, webhook, message, message_file: Path) -> bool:
+        session = self._sessions.get(webhook)
+        if session is None:
+            session = self._sessions[webhook] = requests.Session()
+
+        backoff = SlackDeliveryQueue.initial_backoff
+        for attempt in range(1, SlackDeliveryQueue.max_attempts + 1):
+            delay = backoff
+            try:
+                response = session.post(webhook, json=message, timeout=SlackDeliveryQueue.timeout)
+                if response.status_code == 200:
+                    return True
+
+                if response.status_code == 429:
+                    retry_after = ThrottlingGovernor._parse_retry_after(response.headers.get("Retry-After"))
+                    delay = max(0.0, retry_after) if retry_after is not None else backoff
+                    metrics.increment("slack_rate_limited")
+                elif response.status_code < 500:
+                    logging.error(f"Error when sending message blocks to slack: {response.status_code} {response.text}")
+                    message_file.rename(self._failed_path / message_file.name)
+                    return False
+                else:
+                    logging.warning(f"Slack responded {response.status_code} (attempt {attempt}/{SlackDeliveryQueue.max_attempts}).")
+            except requests.RequestException as e:
+                logging.warning(f"Could not reach Slack (attempt {attempt}/{SlackDeliveryQueue.max_attempts}): {e}")
+
+            if attempt < SlackDeliveryQueue.max_attempts:
+                time.sleep(min(delay, SlackDeliveryQueue.max_backoff))
+                backoff *= 2
+
+        return False
@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, TypeVar
+
+import requests
+
+from run_metrics import metrics
+
+RETRIED_STATUSES = (429, 500, 502, 503, 504)
+
+T = TypeVar("T")
+
+
+class ThrottlingGovernor(object):
+    max_attempts = 5
+    initial_backoff = 1.0
+    max_backoff = 60.0
+    decrease_interval = 1.0
+    low_remaining_ratio = 0.1
+    _governors: Dict[Tuple[str, str], 'ThrottlingGovernor'] = {}
+    _governors_lock = threading.Lock()
+
+    def __init__(self, name: str, traffic: str, max_concurrency: int):
+        self.name = name
+        self.traffic = traffic
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_limit = self.max_concurrency
+        self.throttled = 0
+        self.retried = 0
+        self.waited = 0.0
+        self._condition = threading.Condition()
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+    @staticmethod
+    def get(name: str, traffic: str, max_concurrency: int) -> 'ThrottlingGovernor':
+        # REST requests and git transfers have their own slots, so long clones do not starve enumeration and the reverse.
+        with ThrottlingGovernor._governors_lock:
+            governor = ThrottlingGovernor._governors.get((name, traffic))
+            if governor is None:
+                governor = ThrottlingGovernor._governors[(name, traffic)] = ThrottlingGovernor(name, traffic, max_concurrency)
+            else:
+                governor.resize(max_concurrency)
+            return governor
+
+    @staticmethod
+    def get_all() -> List['ThrottlingGovernor']:
+        with ThrottlingGovernor._governors_lock:
+            return list(ThrottlingGovernor._governors.values())
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def resize(self, max_concurrency: int):
+        with self._condition:
+            self.max_concurrency = max(1, max_concurrency)
+            self._limit = min(self._limit, self.max_concurrency)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._condition.wait(self._paused_until - now)
+                elif self._in_flight >= int(self._limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+            waited = time.monotonic() - started
+            self.waited += waited
+
+        if waited > 0.01:
+            metrics.record("throttle_wait", waited)
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+        retry_after = ThrottlingGovernor._parse_retry_after(headers.get("Retry-After"))
+        delay = ThrottlingGovernor._parse_float(headers.get("X-RateLimit-Delay"))
+        remaining = ThrottlingGovernor._parse_float(headers.get("X-RateLimit-Remaining"))
+        limit = ThrottlingGovernor._parse_float(headers.get("X-RateLimit-Limit"))
+        reset = ThrottlingGovernor._parse_float(headers.get("X-RateLimit-Reset"))
+
+        throttled = status_code == 429 or retry_after is not None or (delay or 0) > 0
+        exhausted = remaining is not None and limit and remaining <= limit * ThrottlingGovernor.low_remaining_ratio
+        with self._condition:
+            if throttled or exhausted:
+                self._decrease()
+            elif status_code < 500:
+                self._increase()
+
+            if retry_after is not None:
+                self._pause(retry_after)
+            elif remaining is not None and remaining <= 0 and reset:
+                self._pause(reset - time.time())
+
+            if throttled:
+                self.throttled += 1
+
+        if throttled:
+            metrics.increment("requests_throttled")
+            logging.debug(f"Azure DevOps throttled {self.traffic} requests of {self.name} ({status_code}, Retry-After {retry_after}, delay {delay}), "
+                          f"concurrency lowered to {self.limit}.")
+        return retry_after
+
+    def observe_failure(self):
+        with self._condition:
+            self._decrease()
+
+    def request(self, send: Callable[[], requests.Response]) -> requests.Response:
+        backoff = ThrottlingGovernor.initial_backoff
+        for attempt in range(1, ThrottlingGovernor.max_attempts + 1):
+            delay = backoff
+            with self.slot():
+                try:
+                    response = send()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == ThrottlingGovernor.max_attempts:
+                        raise
+                    self.observe_failure()
+                    logging.warning(f"Could not reach Azure DevOps (attempt {attempt}/{ThrottlingGovernor.max_attempts}): {e}")
+                else:
+                    retry_after = self.observe(response.status_code, response.headers)
+                    if response.status_code not in RETRIED_STATUSES or attempt == ThrottlingGovernor.max_attempts:
+                        return response
+                    logging.warning(f"Azure DevOps responded {response.status_code} to {response.request.method} {response.url.split('?')[0]} "
+                                    f"(attempt {attempt}/{ThrottlingGovernor.max_attempts}).")
+                    if retry_after is not None:
+                        delay = retry_after
+
+            self._wait_retry(delay, "requests_retried")
+            backoff *= 2
+
+    def run(self, function: Callable[[], T], is_transient: Callable[[Exception], bool]) -> T:
+        backoff = ThrottlingGovernor.initial_backoff
+        for attempt in range(1, ThrottlingGovernor.max_attempts + 1):
+            with self.slot():
+                try:
+                    result = function()
+                except Exception as e:
+                    if attempt == ThrottlingGovernor.max_attempts or not is_transient(e):
+                        raise
+                    self.observe_failure()
+                    logging.warning(f"{e} (attempt {attempt}/{ThrottlingGovernor.max_attempts})")
+                else:
+                    with self._condition:
+                        self._increase()
+                    return result
+
+            self._wait_retry(backoff, "git_retried")
+            backoff *= 2
+
+    def _wait_retry(self, delay: float, counter: str):
+        delay = min(max(delay, 0), ThrottlingGovernor.max_backoff)
+        with self._condition:
+            self.retried += 1
+            self.waited += delay
+        metrics.increment(counter)
+        time.sleep(delay)
+
+    def _increase(self):
+        if self._limit < self.max_concurrency:
+            self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= ThrottlingGovernor.decrease_interval:
+            self._last_decrease = now
+            self._limit = max(1.0, self._limit / 2)
+            self.min_limit = min(self.min_limit, self.limit)
+
+    def _pause(self, duration: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + min(max(duration, 0), ThrottlingGovernor.max_backoff))
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if value is None:
+            return None
+        seconds = ThrottlingGovernor._parse_float(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_float(value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
@@ -2,6 +2,9 @@ import os
 import shutil
 import stat
 
+size_units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+duration_units = {"": 1, "S": 1, "M": 60, "H": 3600, "D": 86400}
+
 
 def del_rw(action, name, exc):
     try:
@@ -18,3 +21,25 @@ def rmdir(path):
 
     shutil.rmtree(path, onerror=del_rw)
 
+
+def get_directory_size(path):
+    size = 0
+    for root, _, files in os.walk(str(path)):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def parse_size(value):
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1:] if value[-1:] in size_units else ""
+    return int(float(value[:len(value) - len(unit)]) * size_units[unit])
+
+
+def parse_duration(value):
+    value = value.strip().upper()
+    unit = value[-1:] if value[-1:] in duration_units else ""
+    return float(value[:len(value) - len(unit)]) * duration_units[unit]
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import dateutil.parser
+
+from model import GitRepositoryInformation
+
+
+class WorkItem(object):
+    def __init__(self, organization: str, repo_info: GitRepositoryInformation, last_push: Optional[datetime],
+                 remote_branches: Optional[Dict[str, str]], output_all: bool, lease: Optional[str] = None):
+        self.organization = organization
+        self.repo_info = repo_info
+        self.last_push = last_push
+        self.remote_branches = remote_branches
+        self.output_all = output_all
+        self.lease = lease
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "organization": self.organization,
+            "project": self.repo_info.project,
+            "name": self.repo_info.name,
+            "id": self.repo_info.id,
+            "remote_url": self.repo_info.remote_url,
+            "last_push": self.last_push.isoformat() if self.last_push else None,
+            "remote_branches": self.remote_branches,
+            "output_all": self.output_all,
+        }, separators=(",", ":"))
+
+    @staticmethod
+    def from_json(data: str, lease: Optional[str] = None) -> 'WorkItem':
+        value = json.loads(data)
+        repo_info = GitRepositoryInformation(value["organization"], value["project"], value["name"], value["id"], value["remote_url"])
+        last_push = dateutil.parser.isoparse(value["last_push"]) if value["last_push"] else None
+        return WorkItem(value["organization"], repo_info, last_push, value["remote_branches"], value["output_all"], lease)
+
+
+class WorkQueue(ABC):
+    lease_duration = 300
+
+    @abstractmethod
+    def publish(self, item: WorkItem, priority: float):
+        pass
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[WorkItem]:
+        pass
+
+    @abstractmethod
+    def renew(self, item: WorkItem) -> bool:
+        pass
+
+    @abstractmethod
+    def complete(self, item: WorkItem, results: Iterable[List[Dict[str, Any]]]):
+        pass
+
+    @abstractmethod
+    def get_results(self) -> List[Tuple[GitRepositoryInformation, List[Dict[str, Any]]]]:
+        pass
+
+    @abstractmethod
+    def get_failures(self) -> List[GitRepositoryInformation]:
+        pass
+
+    @abstractmethod
+    def count_remaining(self) -> int:
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def get_owner(repo_id: str, workers: Iterable[str]) -> str:
+        return max(workers, key=lambda worker: hashlib.sha256(f"{worker}/{repo_id}".encode("utf-8")).digest())
+
+
+class SqliteWorkQueue(WorkQueue):
+    max_attempts = 3
+    worker_timeout = 120
+    affinity_timeout = 60
+    claim_window = 200
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        # Rollback journal rather than WAL, which does not work when the database is on a network file system.
+        self._connection = sqlite3.connect(str(path), timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=DELETE")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                repo_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                priority REAL NOT NULL,
+                state TEXT NOT NULL,
+                available REAL NOT NULL,
+                worker TEXT,
+                lease TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state_priority ON jobs (state, priority);
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                secrets TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                name TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+        """)
+
+    def publish(self, item: WorkItem, priority: float):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute("""
+                INSERT INTO jobs (repo_id, data, priority, state, available) VALUES (?, ?, ?, 'pending', ?)
+                ON CONFLICT (repo_id) DO UPDATE SET
+                    data = excluded.data, priority = excluded.priority, state = 'pending', available = excluded.available, attempts = 0
+                WHERE state != 'leased'
+            """, (item.repo_info.id, item.to_json(), priority, time.time()))
+
+    def claim(self, worker: str) -> Optional[WorkItem]:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute("INSERT OR REPLACE INTO workers (name, heartbeat) VALUES (?, ?)", (worker, now))
+            self._expire_leases(now)
+
+            workers = [row[0] for row in self._connection.execute(
+                "SELECT name FROM workers WHERE heartbeat >= ?", (now - SqliteWorkQueue.worker_timeout,))]
+            rows = self._connection.execute(
+                "SELECT repo_id, data, available FROM jobs WHERE state = 'pending' ORDER BY priority LIMIT ?", (SqliteWorkQueue.claim_window,)).fetchall()
+            for repo_id, data, available in rows:
+                if WorkQueue.get_owner(repo_id, workers) == worker or now - available >= SqliteWorkQueue.affinity_timeout:
+                    lease = uuid.uuid4().hex
+                    self._connection.execute(
+                        "UPDATE jobs SET state = 'leased', worker = ?, lease = ?, lease_expires = ?, attempts = attempts + 1 WHERE repo_id = ?",
+                        (worker, lease, now + WorkQueue.lease_duration, repo_id))
+                    return WorkItem.from_json(data, lease)
+            return None
+
+    def renew(self, item: WorkItem) -> bool:
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            cursor = self._connection.execute("UPDATE jobs SET lease_expires = ? WHERE repo_id = ? AND lease = ?",
+                                              (time.time() + WorkQueue.lease_duration, item.repo_info.id, item.lease))
+            return cursor.rowcount > 0
+
+    def complete(self, item: WorkItem, results: Iterable[List[Dict[str, Any]]]):
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany("INSERT INTO results (data, secrets) VALUES (?, ?)",
+                                         ((item.to_json(), json.dumps(secrets, separators=(",", ":"))) for secrets in results))
+            self._connection.execute("DELETE FROM jobs WHERE repo_id = ? AND lease = ?", (item.repo_info.id, item.lease))
+
+    def get_results(self) -> List[Tuple[GitRepositoryInformation, List[Dict[str, Any]]]]:
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            rows = self._connection.execute("SELECT id, data, secrets FROM results ORDER BY id").fetchall()
+            if rows:
+                self._connection.execute("DELETE FROM results WHERE id <= ?", (rows[-1][0],))
+        return [(WorkItem.from_json(data).repo_info, json.loads(secrets)) for _, data, secrets in rows]
+
+    def get_failures(self) -> List[GitRepositoryInformation]:
+        # Leases also expire here, so jobs of workers which all stopped are reported without waiting for another claim.
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._expire_leases(time.time())
+            rows = self._connection.execute("SELECT data FROM jobs WHERE state = 'failed'").fetchall()
+            if rows:
+                self._connection.execute("DELETE FROM jobs WHERE state = 'failed'")
+        return [WorkItem.from_json(data).repo_info for data, in rows]
+
+    def count_remaining(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _expire_leases(self, now: float):
+        self._connection.execute("""
+            UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, available = ?, worker = NULL, lease = NULL
+            WHERE state = 'leased' AND lease_expires < ?
+        """, (SqliteWorkQueue.max_attempts, now, now))
@@ -0,0 +1,48 @@
+import shutil
+from collections import Counter
+
+import pytest
+
+from detection_parity import CORPUS_FINDINGS, compare, generate_corpus, get_corpus_key, get_rule
+from synthetic_repositories import SyntheticRepositoryGenerator
+
+requires_gitleaks = pytest.mark.skipif(shutil.which("gitleaks") is None, reason="gitleaks is not installed")
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return generate_corpus(tmp_path_factory.mktemp("parity"))
+
+
+@pytest.fixture(scope="module")
+def synthetic_repositories(tmp_path_factory):
+    generator = SyntheticRepositoryGenerator(tmp_path_factory.mktemp("synthetic"), commits=100, branches=3, branch_commits=10, secrets=8)
+    return generator.generate_organization("parity", 1, 2)
+
+
+@requires_gitleaks
+def test_corpus_findings_match_gitleaks(corpus):
+    result = compare(corpus.path, None)
+    assert result["only_gitleaks"] == []
+    assert result["only_native"] == []
+
+
+@requires_gitleaks
+def test_synthetic_findings_match_gitleaks(synthetic_repositories):
+    for repository in synthetic_repositories:
+        result = compare(repository.path, None)
+        assert result["only_gitleaks"] == []
+        assert result["only_native"] == []
+
+
+def test_corpus_findings_are_the_expected_ones(corpus):
+    result = compare(corpus.path, None, Counter(CORPUS_FINDINGS), get_corpus_key, with_gitleaks=False)
+    assert result["missing"] == []
+    assert result["unexpected"] == []
+
+
+def test_synthetic_findings_are_the_planted_secrets(synthetic_repositories):
+    for repository in synthetic_repositories:
+        result = compare(repository.path, None, Counter({"AWS Access Key": repository.planted_secrets}), get_rule, with_gitleaks=False)
+        assert result["missing"] == []
+        assert result["unexpected"] == []
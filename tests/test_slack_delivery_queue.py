@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+import slack_delivery_queue as slack_delivery_queue_module
+from slack_delivery_queue import SlackDeliveryQueue
+
+WEBHOOK = "https://hooks.slack.com/services/T0/B0/x"
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+
+
+class FakeSession(object):
+    responses = []
+    posts = []
+
+    def post(self, url, json=None, timeout=None):
+        FakeSession.posts.append(json)
+        return FakeSession.responses.pop(0) if FakeSession.responses else FakeResponse(200)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    FakeSession.responses = []
+    FakeSession.posts = []
+    monkeypatch.setattr(slack_delivery_queue_module.requests, "Session", FakeSession)
+    monkeypatch.setattr(SlackDeliveryQueue, "outbox_path", tmp_path)
+    monkeypatch.setattr(SlackDeliveryQueue, "max_attempts", 2)
+    monkeypatch.setattr(SlackDeliveryQueue, "initial_backoff", 0)
+    monkeypatch.setattr(SlackDeliveryQueue, "unavailable_delay", 0.5)
+    return tmp_path
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def get_pending(outbox):
+    return list(outbox.glob("*.json"))
+
+
+def test_sends_the_messages_left_by_previous_runs(outbox):
+    SlackDeliveryQueue().close()
+    (outbox / "1-left.json").write_text('{"webhook": "' + WEBHOOK + '", "text": "fallback", "blocks": []}')
+
+    slack = SlackDeliveryQueue()
+    slack.close()
+    assert FakeSession.posts == [{"text": "fallback", "blocks": []}]
+    assert get_pending(outbox) == []
+
+
+def test_keeps_the_messages_of_an_unavailable_webhook_until_it_is_available_again(outbox):
+    slack = SlackDeliveryQueue()
+    try:
+        FakeSession.responses = [FakeResponse(503), FakeResponse(503)]
+        slack.send(WEBHOOK, [{"type": "section"}])
+        wait_until(lambda: len(FakeSession.posts) == 2)
+
+        # Skipped without trying while the webhook is marked unavailable.
+        slack.send(WEBHOOK, [{"type": "divider"}])
+        slack.resend_pending()
+        time.sleep(0.1)
+        assert len(FakeSession.posts) == 2
+        assert len(get_pending(outbox)) == 2
+
+        # A later sweep sends them once the mark expired.
+        time.sleep(SlackDeliveryQueue.unavailable_delay)
+        assert slack.resend_pending() == 2
+        wait_until(lambda: not get_pending(outbox))
+        assert FakeSession.posts[2:] == [{"text": "fallback", "blocks": [{"type": "section"}]}, {"text": "fallback", "blocks": [{"type": "divider"}]}]
+    finally:
+        slack.close()
+
+
+def test_queues_a_pending_message_once(outbox, monkeypatch):
+    released = threading.Event()
+    monkeypatch.setattr(FakeSession, "post", lambda self, url, json=None, timeout=None: released.wait(5) and FakeResponse(200))
+    slack = SlackDeliveryQueue()
+    try:
+        slack.send(WEBHOOK, [{"type": "section"}])
+        slack.send(WEBHOOK, [{"type": "divider"}])
+
+        # The first message is being delivered and the second one is queued, the sweep does not queue them again.
+        assert slack.resend_pending() == 0
+    finally:
+        released.set()
+        slack.close()
+    assert get_pending(outbox) == []
+
+
+def test_falls_back_to_the_backoff_when_retry_after_is_not_a_number(outbox):
+    FakeSession.responses = [FakeResponse(429, {"Retry-After": "soon"}), FakeResponse(200)]
+    slack = SlackDeliveryQueue()
+    slack.send(WEBHOOK, [{"type": "section"}])
+    slack.close()
+    assert len(FakeSession.posts) == 2
+    assert get_pending(outbox) == []
+
+
+def test_keeps_the_message_in_the_outbox_when_sending_fails_unexpectedly(outbox, monkeypatch):
+    def post(self, url, json=None, timeout=None):
+        FakeSession.posts.append(json)
+        if len(FakeSession.posts) == 1:
+            raise RuntimeError("unexpected")
+        return FakeResponse(200)
+
+    monkeypatch.setattr(FakeSession, "post", post)
+    slack = SlackDeliveryQueue()
+    try:
+        slack.send(WEBHOOK, [{"type": "section"}])
+        # The delivery thread survived and the message is sent by the next sweep.
+        wait_until(lambda: slack.resend_pending() == 1)
+        wait_until(lambda: not get_pending(outbox))
+        assert len(FakeSession.posts) == 2
+    finally:
+        slack.close()
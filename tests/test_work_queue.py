@@ -0,0 +1,120 @@
+import pytest
+
+import work_queue as work_queue_module
+from model import GitRepositoryInformation
+from work_queue import SqliteWorkQueue, WorkItem, WorkQueue
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1600000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = SqliteWorkQueue(tmp_path / "work-queue.db")
+    yield queue
+    queue.close()
+
+
+def create_item(name="repository", output_all=False):
+    return WorkItem("org", GitRepositoryInformation("org", "project", name, f"id-{name}", f"https://dev.azure.com/org/project/_git/{name}"),
+                    None, {"origin/main": "a" * 40}, output_all)
+
+
+def test_claimed_item_is_completed_with_its_results(queue):
+    queue.publish(create_item(), 1)
+    assert queue.count_remaining() == 1
+
+    item = queue.claim("worker")
+    assert (item.repo_info.id, item.remote_branches, item.output_all) == ("id-repository", {"origin/main": "a" * 40}, False)
+    assert queue.claim("worker") is None
+    assert queue.count_remaining() == 1
+
+    queue.complete(item, [[{"rule": "AWS Access Key"}], [{"rule": "Slack"}]])
+    assert queue.count_remaining() == 0
+    assert [(repo_info.id, secrets) for repo_info, secrets in queue.get_results()] == [("id-repository", [{"rule": "AWS Access Key"}]),
+                                                                                       ("id-repository", [{"rule": "Slack"}])]
+    assert queue.get_results() == []
+
+
+def test_items_are_claimed_by_priority(queue, clock):
+    clock.now += SqliteWorkQueue.affinity_timeout
+    queue.publish(create_item("later"), 2)
+    queue.publish(create_item("first"), 1)
+    clock.now += SqliteWorkQueue.affinity_timeout
+
+    assert [queue.claim("worker").repo_info.name for _ in range(2)] == ["first", "later"]
+
+
+def test_item_waits_for_its_owner_before_going_to_another_worker(queue, clock):
+    queue.claim("worker-a")
+    queue.claim("worker-b")
+    item = create_item()
+    owner = WorkQueue.get_owner(item.repo_info.id, ["worker-a", "worker-b"])
+    other = "worker-b" if owner == "worker-a" else "worker-a"
+
+    queue.publish(item, 1)
+    assert queue.claim(other) is None
+    clock.now += SqliteWorkQueue.affinity_timeout
+    assert queue.claim(other) is not None
+
+
+def test_renewed_lease_does_not_expire(queue, clock):
+    queue.publish(create_item(), 1)
+    item = queue.claim("worker")
+
+    clock.now += WorkQueue.lease_duration * 2 / 3
+    assert queue.renew(item)
+    clock.now += WorkQueue.lease_duration * 2 / 3
+    assert queue.claim("other") is None
+    assert queue.get_failures() == []
+
+
+def test_expired_lease_gives_the_item_to_another_worker(queue, clock):
+    queue.publish(create_item(), 1)
+    lost = queue.claim("worker")
+
+    clock.now += WorkQueue.lease_duration + 1
+    item = queue.claim("other")
+    assert item is not None and item.lease != lost.lease
+    assert not queue.renew(lost)
+
+    # The late results of the first worker do not complete the item leased to the other one.
+    queue.complete(lost, [])
+    assert queue.count_remaining() == 1
+    queue.complete(item, [])
+    assert queue.count_remaining() == 0
+
+
+def test_item_fails_after_its_lease_expired_too_many_times(queue, clock):
+    queue.publish(create_item(), 1)
+    for _ in range(SqliteWorkQueue.max_attempts):
+        assert queue.claim("worker") is not None
+        assert queue.get_failures() == []
+        clock.now += WorkQueue.lease_duration + 1
+
+    # The coordinator expires the last lease itself, without waiting for a worker to claim.
+    assert [repo_info.id for repo_info in queue.get_failures()] == ["id-repository"]
+    assert queue.get_failures() == []
+    assert queue.count_remaining() == 0
+    assert queue.claim("worker") is None
+
+
+def test_publishing_a_leased_item_keeps_its_lease(queue, clock):
+    queue.publish(create_item(), 1)
+    item = queue.claim("worker")
+    queue.publish(create_item(output_all=True), 1)
+
+    assert queue.renew(item)
+    assert queue.claim("other") is None